@@ -0,0 +1,172 @@
+"""
+Headless batch runner for unattended parameter sweeps.
+
+Reads a parameter table (CSV or JSON) with one profile per row, computes all waveforms in a
+background thread and loads and triggers them one after another. While step N is being
+triggered, the waveforms of the following steps are already computed and encoded.
+The measured timings of every step are written to a results file (CSV or JSON).
+
+Columns (times in milliseconds, amplitudes in Volts):
+  spike_amplitude, ref_amplitude, spike_time, ref_time, delta_t   required
+  signal_type (Square), single_pulse (false), burst (true),
+  triggers (1), interval (100)                                    optional
+
+Usage:
+  python batchrun.py sweep.csv --results results.csv            # searches the generator
+  python batchrun.py sweep.json --port 6 --enable-output
+  python batchrun.py sweep.csv --simulate                        # simulated generator
+"""
+import argparse
+import csv
+import json
+import queue
+import threading
+import time
+import wavefunctions as pf
+
+REQUIRED_COLUMNS = ("spike_amplitude", "ref_amplitude", "spike_time", "ref_time", "delta_t")
+DEFAULTS = {"signal_type": "Square", "single_pulse": False, "burst": True, "triggers": 1, "interval": 100}
+
+def parseBool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "true", "yes", "y", "on")
+
+def readParameters(path):
+    """
+    Reads and checks the parameter table.
+
+    Returns:
+      list: One dict per step with the columns converted to numbers/booleans.
+
+    Raises:
+      ValueError: If a row misses a required column or has an invalid value.
+    """
+    with open(path, newline="") as file:
+        rows = json.load(file) if path.lower().endswith(".json") else list(csv.DictReader(file))
+
+    steps = []
+    for number, row in enumerate(rows, start=1):
+        row = {key.strip(): value for key, value in row.items() if value not in (None, "")}
+        missing = [column for column in REQUIRED_COLUMNS if column not in row]
+        if missing:
+            raise ValueError(f"Row {number}: missing {', '.join(missing)}.")
+        step = dict(DEFAULTS, **row)
+        for column in REQUIRED_COLUMNS + ("interval",):
+            step[column] = pf.safe_float(step[column], f"Row {number}: {column}")
+        step["triggers"] = int(pf.safe_float(step["triggers"], f"Row {number}: triggers"))
+        step["single_pulse"] = parseBool(step["single_pulse"])
+        step["burst"] = parseBool(step["burst"])
+        steps.append(step)
+    return steps
+
+def computeProfiles(steps, profiles):
+    """Builds the profile of every step and puts (profile, seconds, error) into the profiles queue in order."""
+    for step in steps:
+        start = time.perf_counter()
+        try:
+            profile = pf.buildProfile(step["signal_type"], step["spike_amplitude"], step["ref_amplitude"],
+                                      step["spike_time"], step["ref_time"], step["delta_t"], step["single_pulse"])
+            error = None if profile is not None else ValueError(f"Unknown signal type {step['signal_type']}.")
+        except Exception as e:
+            profile, error = None, e
+        profiles.put((profile, time.perf_counter() - start, error))
+
+def runSteps(steps, stopOnError=False, enableOutput=False, progress=print):
+    """
+    Loads and triggers all steps on the generator of the global session.
+    The profiles are computed by a background thread that runs ahead of the device.
+    With enableOutput the output is only on while the triggers of a step are sent,
+    because loading a profile with the output on distorts the output.
+
+    Returns:
+      list: One result dict per step with the parameters and the measured timings.
+    """
+    profiles = queue.Queue()
+    threading.Thread(target=computeProfiles, args=(steps, profiles), name="ProfileComputer", daemon=True).start()
+
+    results = []
+    for index, step in enumerate(steps, start=1):
+        result = dict(step, step=index, computeSeconds=None, loadSeconds=None, triggerSeconds=None,
+                      meanInterval=None, jitter=None, drift=None, error=None)
+        waitStart = time.perf_counter()
+        profile, result["computeSeconds"], error = profiles.get()
+        result["waitForComputeSeconds"] = time.perf_counter() - waitStart
+        try:
+            if error is not None:
+                raise error
+            progress(f"Step {index}/{len(steps)}: loading")
+            start = time.perf_counter()
+            pf.applyProfile(profile, step["burst"], progress=lambda message: None)
+            result["loadSeconds"] = time.perf_counter() - start
+
+            if step["triggers"] > 0:
+                progress(f"Step {index}/{len(steps)}: {step['triggers']} triggers")
+                if enableOutput:
+                    pf.turnOnOutput()
+                try:
+                    start = time.perf_counter()
+                    train = pf.sendTriggerTrain(step["triggers"], step["interval"] / 1000)
+                    result["triggerSeconds"] = time.perf_counter() - start
+                finally:
+                    if enableOutput:
+                        time.sleep(pf.session.burstDurationSeconds) # Let the last burst finish
+                        pf.turnOffOutput()
+                for key in ("meanInterval", "jitter", "drift"):
+                    result[key] = train[key]
+        except Exception as e:
+            result["error"] = str(e)
+            progress(f"Step {index}/{len(steps)} failed: {e}")
+            if stopOnError:
+                results.append(result)
+                break
+        results.append(result)
+    return results
+
+def writeResults(path, results):
+    """Writes the step results as JSON (.json) or CSV (everything else)."""
+    with open(path, "w", newline="") as file:
+        if path.lower().endswith(".json"):
+            json.dump(results, file, indent=2)
+        else:
+            columns = list(dict.fromkeys(key for result in results for key in result))
+            writer = csv.DictWriter(file, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(results)
+
+def connect(args):
+    """Sets the session to the generator chosen on the command line."""
+    if args.simulate:
+        pf.useSimulatedInstrument()
+    elif args.address:
+        pf.setInstrumentAddress(args.address)
+    elif args.port is not None:
+        pf.setUsbPort(args.port)
+    else:
+        found = pf.discoverInstrument()
+        if not found:
+            raise SystemExit("No generator found. Use --port or --address.")
+        print(f"Found {found[1]} at {found[0]}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a table of profiles on the generator without the GUI.")
+    parser.add_argument("parameters", help="CSV or JSON file with one profile per row")
+    parser.add_argument("--results", default="results.csv", help="CSV or JSON file for the measured timings")
+    parser.add_argument("--port", type=int, help="USB (COM) port of the generator")
+    parser.add_argument("--address", help="pyvisa address of the generator")
+    parser.add_argument("--simulate", action="store_true", help="Use a simulated generator")
+    parser.add_argument("--enable-output", action="store_true", help="Turn the output on while the triggers of each step are sent")
+    parser.add_argument("--stop-on-error", action="store_true", help="Stop at the first failed step")
+    args = parser.parse_args()
+
+    steps = readParameters(args.parameters)
+    connect(args)
+    try:
+        if args.enable_output:
+            pf.turnOffOutput()
+        results = runSteps(steps, args.stop_on_error, args.enable_output)
+    finally:
+        pf.session.close()
+    writeResults(args.results, results)
+    failed = sum(result["error"] is not None for result in results)
+    print(f"{len(results)} steps done ({failed} failed). Results written to {args.results}")
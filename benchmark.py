@@ -0,0 +1,144 @@
+"""
+Benchmarks for the waveform pipeline and the upload path.
+
+Sweeps pulse width, numberScaleFactor and delta t and measures every stage of a profile load:
+  - in-process: generateSQUSQU, getPulseDifference, createArbString, createArbDac + createDacBlock
+    and the fused createSquareArb (into a reused buffer) used by buildProfile
+  - against the simulated instrument: the ASCII upload (sendAndSaveCustom) and the full
+    binary profile load (buildProfile + applyProfile)
+For every stage the time, the peak memory and the bytes on the wire are stored as JSON.
+
+Usage:
+  python benchmark.py                                  # writes benchmark_results.json
+  python benchmark.py --output new.json --compare benchmark_results.json
+"""
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+import numpy as np
+import mathfunctions as mf
+import wavefunctions as pf
+
+PULSE_WIDTHS = (1, 10, 100) # Spike + reference time in milliseconds (30 % spike, 70 % reference)
+SCALE_FACTORS = (None, 50, 200, 1000) # None = minimal point count
+DELTAS = (0.1, 1) # Delta t in milliseconds
+MAX_POINTS = 65536 # Largest arb of the 33220A
+
+def measure(func, repeats):
+    """Runs func repeats times. Returns (result, best time in seconds, peak memory in bytes)."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, best, peak
+
+def benchmarkCase(width, factor, delta, repeats, sim):
+    """Benchmarks all stages for one parameter set and returns the list of result records."""
+    spike, ref = 0.3 * width, 0.7 * width
+    pf.numberScaleFactor = factor
+    timeStep = pf.getTimeStep(spike, ref, delta, minPoints=pf.minimumPoints)
+    spikePoints, refPoints = int(round(spike / timeStep)), int(round(ref / timeStep))
+    deltaPoints = int(round(delta / timeStep))
+    case = {"pulseWidth": width, "numberScaleFactor": factor, "delta": delta}
+    records = []
+
+    def record(stage, seconds, peak, wireBytes=0, points=0, **extra):
+        records.append(dict(case, stage=stage, seconds=seconds, peakMemory=peak, wireBytes=wireBytes, points=points, **extra))
+
+    pulse, seconds, peak = measure(lambda: mf.generateSQUSQU(2.0, 1.0, spikePoints, refPoints, spikePoints + refPoints), repeats)
+    record("generateSQUSQU", seconds, peak, points=len(pulse))
+    pulseDiff, seconds, peak = measure(lambda: mf.getPulseDifference(pulse, deltaPoints), repeats)
+    record("getPulseDifference", seconds, peak, points=len(pulseDiff))
+    (datastring, _, _), seconds, peak = measure(lambda: mf.createArbString(pulseDiff, 0), repeats)
+    record("createArbString", seconds, peak, wireBytes=len(datastring), points=len(pulseDiff))
+    block, seconds, peak = measure(lambda: mf.createDacBlock(mf.createArbDac(np.insert(pulseDiff, 0, 0.0))[0]), repeats)
+    record("createArbDac", seconds, peak, wireBytes=len(pf.prologixEscape(block)), points=len(pulseDiff) + 1)
+    buffer = np.empty(len(pulseDiff) + 1, dtype=np.int16)
+    (codes, _, _), seconds, peak = measure(lambda: mf.createSquareArb(2.0, 1.0, spikePoints, refPoints, deltaPoints, out=buffer), repeats)
+    record("createSquareArb", seconds, peak, points=len(codes))
+
+    # Device stages on the simulated instrument. The device and everything the session knows about it are reset for every run, so each run uploads.
+    if len(pulseDiff) + 1 > MAX_POINTS:
+        return records
+    for stage, upload in (
+            ("uploadAscii", lambda: pf.sendAndSaveCustom("0," + datastring)),
+            ("loadProfile", lambda: pf.applyProfile(pf.buildProfile("Square", 2.0, 1.0, spike, ref, delta, False), True, progress=lambda message: None))):
+        def run():
+            sim.reset()
+            pf.session.invalidateState()
+            upload()
+        _, seconds, peak = measure(run, repeats)
+        record(stage, seconds, peak, wireBytes=sim.bytesReceived + sim.bytesSent,
+               points=len(sim.activeWaveform()), deviceSeconds=sim.simulatedSeconds, commands=len(sim.commands))
+    return records
+
+def runBenchmarks(repeats=5):
+    """Runs the whole sweep and returns the results as a dict."""
+    sim = pf.useSimulatedInstrument(realtime=False)
+    previousFactor, previousStore = pf.numberScaleFactor, pf.useWaveformStore
+    pf.useWaveformStore = False # Measure the computation, not the store
+    results = []
+    try:
+        for width in PULSE_WIDTHS:
+            for factor in SCALE_FACTORS:
+                for delta in DELTAS:
+                    results.extend(benchmarkCase(width, factor, delta, repeats, sim))
+    finally:
+        pf.numberScaleFactor, pf.useWaveformStore = previousFactor, previousStore
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "repeats": repeats,
+        "results": results,
+    }
+
+def resultKey(record):
+    return (record["stage"], record["pulseWidth"], record["numberScaleFactor"], record["delta"])
+
+def compareResults(current, baseline, threshold=1.25):
+    """Prints every stage that got slower, bigger or sends more bytes than threshold times the baseline. Returns the number of regressions."""
+    baselineRecords = {resultKey(record): record for record in baseline["results"]}
+    regressions = 0
+    for record in current["results"]:
+        old = baselineRecords.get(resultKey(record))
+        if old is None:
+            continue
+        for metric in ("seconds", "peakMemory", "wireBytes", "deviceSeconds"):
+            if old.get(metric) and record.get(metric, 0) > threshold * old[metric]:
+                regressions += 1
+                print(f"REGRESSION {record['stage']} width={record['pulseWidth']} factor={record['numberScaleFactor']} "
+                      f"delta={record['delta']}: {metric} {old[metric]:.4g} -> {record[metric]:.4g}")
+    return regressions
+
+def printResults(results):
+    print(f"{'stage':<20}{'width':>7}{'factor':>8}{'delta':>7}{'points':>9}{'time [ms]':>12}{'peak [kB]':>11}{'wire [B]':>10}{'device [s]':>12}")
+    for record in results["results"]:
+        print(f"{record['stage']:<20}{record['pulseWidth']:>7}{str(record['numberScaleFactor']):>8}{record['delta']:>7}"
+              f"{record['points']:>9}{record['seconds'] * 1000:>12.3f}{record['peakMemory'] / 1024:>11.1f}"
+              f"{record['wireBytes']:>10}{record.get('deviceSeconds', 0):>12.3f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the waveform pipeline and the upload path.")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file for the results")
+    parser.add_argument("--compare", help="JSON file of an earlier run to check for regressions")
+    parser.add_argument("--repeats", type=int, default=5, help="Runs per stage (the best time is reported)")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Ratio to the baseline that counts as a regression")
+    args = parser.parse_args()
+
+    results = runBenchmarks(args.repeats)
+    printResults(results)
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as file:
+            if compareResults(results, json.load(file), args.threshold):
+                raise SystemExit(1)
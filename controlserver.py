@@ -0,0 +1,294 @@
+"""
+Local control server, so other programs (acquisition scripts, notebooks, ...) can use the generator.
+
+Runs a small HTTP server on localhost. Every request is put into one queue and executed on the
+generator one after another by a single thread, so the setups of different clients never mix.
+  - A profile load that is identical to a load still waiting in the queue (and not followed by a
+    different load) is not queued again; both clients get the result of the same load.
+  - Triggers with the same interval waiting in the queue one after another are sent as one trigger train.
+
+Endpoints (JSON in and out, times in milliseconds, amplitudes in Volts):
+  POST /load     {"spike_amplitude", "ref_amplitude", "spike_time", "ref_time", "delta_t",
+                  optional "signal_type" (Square), "single_pulse" (false), "burst" (true)}
+  POST /trigger  {optional "count" (1), "interval" (100)}
+  POST /output   {"on": true/false}
+  POST /reset    {"duration" (seconds), "amplitude"}
+  GET  /status
+
+Usage:
+  python controlserver.py                        # searches the generator, listens on port 8765
+  python controlserver.py --port 6 --http-port 9000
+  python controlserver.py --simulate
+
+From another program:
+  client = ControlClient()
+  client.load(spike_amplitude=2, ref_amplitude=1, spike_time=3, ref_time=7, delta_t=1)
+  client.trigger()
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import wavefunctions as pf
+from batchrun import REQUIRED_COLUMNS, parseBool, connect
+
+DEFAULT_HTTP_PORT = 8765
+LOAD_DEFAULTS = {"signal_type": "Square", "single_pulse": False, "burst": True}
+REQUEST_TIMEOUT_SECONDS = 120 # Longest time a client waits for its request (including the time in the queue)
+
+class ControlRequest:
+    """A queued request. The clients that share it wait for done and then read result or error."""
+
+    def __init__(self, kind, parameters):
+        self.kind = kind
+        self.parameters = parameters
+        self.clients = 1 # Number of clients sharing this request (coalesced loads)
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def finish(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.done.set()
+
+def parseLoad(parameters):
+    """Checks and converts the parameters of a load request. Raises ValueError if one is missing or invalid."""
+    missing = [name for name in REQUIRED_COLUMNS if name not in parameters]
+    if missing:
+        raise ValueError(f"Missing {', '.join(missing)}.")
+    load = dict(LOAD_DEFAULTS, **{name: parameters[name] for name in LOAD_DEFAULTS if name in parameters})
+    for name in REQUIRED_COLUMNS:
+        load[name] = pf.safe_float(parameters[name], name)
+    load["single_pulse"] = parseBool(load["single_pulse"])
+    load["burst"] = parseBool(load["burst"])
+    return load
+
+def parseTrigger(parameters):
+    count = int(pf.safe_float(parameters.get("count", 1), "count"))
+    if count < 1:
+        raise ValueError("count must be at least 1.")
+    return {"count": count, "interval": pf.safe_float(parameters.get("interval", 100), "interval")}
+
+def parseOutput(parameters):
+    if "on" not in parameters:
+        raise ValueError("Missing on.")
+    return {"on": parseBool(parameters["on"])}
+
+def parseReset(parameters):
+    missing = [name for name in ("duration", "amplitude") if name not in parameters]
+    if missing:
+        raise ValueError(f"Missing {', '.join(missing)}.")
+    return {"duration": pf.safe_float(parameters.get("duration"), "duration"),
+            "amplitude": pf.safe_float(parameters.get("amplitude"), "amplitude")}
+
+PARSERS = {"load": parseLoad, "trigger": parseTrigger, "output": parseOutput, "reset": parseReset}
+
+class ControlQueue:
+    """
+    Executes the requests of all clients one after another on the generator of the global session.
+    """
+
+    def __init__(self):
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self.loadedProfile = None # Parameters of the last successful load
+        self.completed = 0
+        self.coalesced = 0
+        self._thread = threading.Thread(target=self._run, name="ControlQueue", daemon=True)
+        self._thread.start()
+
+    def submit(self, kind, parameters):
+        """
+        Checks the parameters and queues the request. Returns the ControlRequest to wait for.
+
+        Raises:
+          ValueError: For an unknown kind or invalid parameters.
+        """
+        if kind not in PARSERS:
+            raise ValueError(f"Unknown request {kind}.")
+        parameters = PARSERS[kind](parameters)
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError("The control server is stopped.")
+            if kind == "load":
+                lastLoad = next((request for request in reversed(self._pending) if request.kind == "load"), None)
+                if lastLoad is not None and lastLoad.parameters == parameters:
+                    lastLoad.clients += 1 # Same profile is loaded anyway, share the result
+                    self.coalesced += 1
+                    return lastLoad
+            request = ControlRequest(kind, parameters)
+            self._pending.append(request)
+            self._condition.notify()
+            return request
+
+    def status(self):
+        with self._condition:
+            return {"pending": len(self._pending), "completed": self.completed, "coalesced": self.coalesced,
+                    "loadedProfile": self.loadedProfile, "address": pf.session.address}
+
+    def stop(self):
+        """Stops the queue. Pending requests fail."""
+        with self._condition:
+            self._stopped = True
+            pending, self._pending = list(self._pending), deque()
+            self._condition.notify()
+        for request in pending:
+            request.finish(error=RuntimeError("The control server was stopped."))
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                requests = [self._pending.popleft()]
+                while (requests[0].kind == "trigger" and self._pending and self._pending[0].kind == "trigger"
+                       and self._pending[0].parameters["interval"] == requests[0].parameters["interval"]):
+                    requests.append(self._pending.popleft()) # Triggers in a row with the same interval are sent as one train
+            try:
+                results = self._execute(requests)
+            except Exception as e:
+                for request in requests:
+                    request.finish(error=e)
+            else:
+                for request, result in zip(requests, results):
+                    request.finish(result)
+            with self._condition:
+                self.completed += len(requests)
+
+    def _execute(self, requests):
+        """Runs the requests (several only for triggers) and returns one result per request."""
+        request = requests[0]
+        parameters = request.parameters
+        if request.kind == "load":
+            profile = pf.buildProfile(parameters["signal_type"], parameters["spike_amplitude"], parameters["ref_amplitude"],
+                                      parameters["spike_time"], parameters["ref_time"], parameters["delta_t"], parameters["single_pulse"])
+            if profile is None:
+                raise ValueError(f"Unknown signal type {parameters['signal_type']}.")
+            start = time.perf_counter()
+            pf.applyProfile(profile, parameters["burst"], progress=lambda message: None)
+            self.loadedProfile = parameters
+            return [{"loadSeconds": time.perf_counter() - start, "clients": request.clients, "points": len(profile["dacCodes"]),
+                     "frequency": profile["frequency"], "amplitude": profile["amplitude"], "offset": profile["offset"],
+                     "triggerDelay": profile["triggerDelay"]}]
+        if request.kind == "trigger":
+            counts = [request.parameters["count"] for request in requests]
+            interval = request.parameters["interval"] / 1000 # The same for all of them
+            timestamps = pf.sendTriggerTrain(sum(counts), interval)["timestamps"] # Taken right before each *TRG, also for a single one
+            results, first = [], 0
+            for count in counts:
+                results.append({"timestamps": timestamps[first:first + count], "batched": len(requests)})
+                first += count
+            return results
+        if request.kind == "output":
+            (pf.turnOnOutput if parameters["on"] else pf.turnOffOutput)()
+            return [{"on": parameters["on"]}]
+        if request.kind == "reset":
+            pf.sendReset(parameters["duration"], parameters["amplitude"])
+            return [{}]
+        raise ValueError(f"Unknown request {request.kind}.")
+
+class ControlRequestHandler(BaseHTTPRequestHandler):
+    """Translates the HTTP requests into ControlQueue requests (see the module docstring)."""
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/status":
+            self._reply(200, self.server.controlQueue.status())
+        else:
+            self._reply(404, {"error": f"Unknown path {self.path}."})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            parameters = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(parameters, dict):
+                raise ValueError("The body must be a JSON object.")
+            request = self.server.controlQueue.submit(self.path.strip("/"), parameters)
+        except (ValueError, TypeError) as e: # Also invalid JSON and values of the wrong type
+            self._reply(400, {"error": str(e)})
+            return
+        except RuntimeError as e:
+            self._reply(503, {"error": str(e)})
+            return
+        if not request.done.wait(REQUEST_TIMEOUT_SECONDS):
+            self._reply(504, {"error": "The request did not finish in time."})
+        elif request.error is not None:
+            self._reply(500, {"error": str(request.error)})
+        else:
+            self._reply(200, request.result)
+
+    def _reply(self, status, content):
+        body = json.dumps(content).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # No line per request on the console
+
+def createServer(port=DEFAULT_HTTP_PORT, host="127.0.0.1"):
+    """Returns the HTTP server with its ControlQueue (server.controlQueue). Call serve_forever() to run it."""
+    server = ThreadingHTTPServer((host, port), ControlRequestHandler)
+    server.daemon_threads = True
+    server.controlQueue = ControlQueue()
+    return server
+
+class ControlClient:
+    """Minimal client for the control server. Raises RuntimeError with the message of the server if a request fails."""
+
+    def __init__(self, port=DEFAULT_HTTP_PORT, host="127.0.0.1", timeoutSeconds=REQUEST_TIMEOUT_SECONDS):
+        self.url = f"http://{host}:{port}"
+        self.timeoutSeconds = timeoutSeconds
+
+    def _request(self, path, parameters=None):
+        data = None if parameters is None else json.dumps(parameters).encode("utf-8")
+        request = urllib.request.Request(self.url + path, data=data, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeoutSeconds) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(json.load(e).get("error", str(e))) from e
+
+    def load(self, **parameters):
+        return self._request("/load", parameters)
+
+    def trigger(self, count=1, interval=100):
+        return self._request("/trigger", {"count": count, "interval": interval})
+
+    def output(self, on):
+        return self._request("/output", {"on": on})
+
+    def reset(self, duration, amplitude):
+        return self._request("/reset", {"duration": duration, "amplitude": amplitude})
+
+    def status(self):
+        return self._request("/status")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lets other programs on this PC use the generator over HTTP.")
+    parser.add_argument("--http-port", type=int, default=DEFAULT_HTTP_PORT, help="Port of the HTTP server (localhost only)")
+    parser.add_argument("--port", type=int, help="USB (COM) port of the generator")
+    parser.add_argument("--address", help="pyvisa address of the generator")
+    parser.add_argument("--simulate", action="store_true", help="Use a simulated generator")
+    args = parser.parse_args()
+
+    connect(args)
+    server = createServer(args.http_port)
+    print(f"Control server listening on http://127.0.0.1:{args.http_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.controlQueue.stop()
+        server.server_close()
+        pf.session.close()
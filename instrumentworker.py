@@ -0,0 +1,148 @@
+import queue
+import threading
+import time
+
+class CancelledError(Exception):
+    """Raised inside a job when it was cancelled while running."""
+
+class Job:
+    """
+    A single command for the instrument worker.
+
+    Holds the function to run and the callbacks for the GUI. The callbacks are always
+    called on the Tk main thread (see InstrumentWorker).
+    """
+
+    def __init__(self, func, args, kwargs, onDone=None, onError=None, onProgress=None, timeoutSeconds=None, name=None):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.onDone = onDone
+        self.onError = onError
+        self.onProgress = onProgress
+        self.timeoutSeconds = timeoutSeconds
+        self.name = name or getattr(func, "__name__", "job")
+        self.cancelled = False
+        self.finished = False
+        self.startTime = None
+        self._worker = None
+
+    def cancel(self):
+        """Cancels the job. A pending job is skipped, a running job stops at its next progress report."""
+        self.cancelled = True
+
+    def reportProgress(self, message):
+        """Passes a progress message to onProgress. Raises CancelledError if the job was cancelled."""
+        if self.cancelled:
+            raise CancelledError(f"{self.name} was cancelled.")
+        if self.onProgress is not None:
+            self._worker._post(self, self.onProgress, message)
+
+class InstrumentWorker:
+    """
+    Runs instrument commands one after another on a dedicated thread, so the Tk window never
+    blocks on device I/O.
+
+    Jobs are queued with submit(). Their callbacks (onDone, onError, onProgress) are handed back
+    to the Tk event loop through a second queue, which is polled with root.after().
+    A job that runs longer than its timeout is reported as failed right away; the worker thread
+    itself finishes the call once the VISA timeout of the session expires and discards its result.
+    """
+
+    def __init__(self, root, pollMs=50):
+        self.root = root
+        self.pollMs = pollMs
+        self._jobs = queue.Queue()
+        self._callbacks = queue.Queue()
+        self._current = None
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="InstrumentWorker", daemon=True) # Daemon, so a hanging port cannot keep the program open
+        self._thread.start()
+        self.root.after(self.pollMs, self._poll)
+
+    def submit(self, func, *args, onDone=None, onError=None, onProgress=None, timeoutSeconds=None, withProgress=False, name=None, **kwargs):
+        """
+        Queues func(*args, **kwargs) for the worker thread and returns its Job.
+
+        Parameters:
+          onDone (callable, optional): Called with the return value of func.
+          onError (callable, optional): Called with the exception if func fails, times out or is cancelled.
+          onProgress (callable, optional): Called with every progress message of the job.
+          timeoutSeconds (float, optional): Time after which the job is reported as failed.
+          withProgress (bool, optional): If True, func gets the keyword argument progress=job.reportProgress.
+          name (str, optional): Name of the job for messages. Defaults to the function name.
+        """
+        job = Job(func, args, kwargs, onDone, onError, onProgress, timeoutSeconds, name)
+        job._worker = self
+        if withProgress:
+            job.kwargs = dict(kwargs, progress=job.reportProgress)
+        self._jobs.put(job)
+        return job
+
+    def cancelAll(self):
+        """Cancels the running job and all pending jobs."""
+        if self._current is not None:
+            self._current.cancel()
+        for job in list(self._jobs.queue):
+            job.cancel()
+
+    def busy(self):
+        """Returns True if a job is running or waiting."""
+        return self._current is not None or not self._jobs.empty()
+
+    def stop(self):
+        """Cancels all jobs and ends the worker thread after the running job."""
+        self._stopped = True
+        self.cancelAll()
+        self._jobs.put(None)
+
+    def _post(self, job, callback, *args):
+        self._callbacks.put((job, callback, args))
+
+    def _finish(self, job, callback, *args):
+        # Only the first result of a job counts (a timed out job may still return later)
+        if not job.finished:
+            job.finished = True
+            if callback is not None:
+                self._post(job, callback, *args)
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            if job.cancelled:
+                self._finish(job, job.onError, CancelledError(f"{job.name} was cancelled."))
+                continue
+            self._current = job
+            job.startTime = time.monotonic()
+            try:
+                result = job.func(*job.args, **job.kwargs)
+            except Exception as e:
+                self._finish(job, job.onError, e)
+            else:
+                self._finish(job, job.onDone, result)
+            finally:
+                self._current = None
+
+    def _poll(self):
+        # Report a running job that exceeded its timeout
+        job = self._current
+        if job is not None and job.timeoutSeconds is not None and not job.finished:
+            if time.monotonic() - job.startTime > job.timeoutSeconds:
+                job.cancel()
+                self._finish(job, job.onError, TimeoutError(f"{job.name} did not finish within {job.timeoutSeconds} s."))
+
+        # Run the callbacks of the worker thread on the Tk main thread
+        while True:
+            try:
+                job, callback, args = self._callbacks.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"Callback of {job.name} failed: {e}")
+
+        if not self._stopped:
+            self.root.after(self.pollMs, self._poll)
@@ -1,13 +1,11 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 import numpy as np
-import matplotlib
-matplotlib.use("TkAgg")
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from matplotlib.figure import Figure
-from tkinter import simpledialog, messagebox
+from tkinter import simpledialog, messagebox, filedialog
 # --- Import Custom Wavefunctions Module ---
 import wavefunctions as pf
+from instrumentworker import InstrumentWorker, CancelledError
+from tracing import tracer
 
 # Global variable for output state: False = off, True = on.
 output_state = False
@@ -15,12 +13,20 @@ triggerActive = False
 # --- Callback Functions ---
 def get_usb_port():
     """
-    Asks the user for the USB port number and sets it in the wavefunctions module.
+    Searches for the generator on all serial ports. If it is not found,
+    asks the user for the USB port number and sets it in the wavefunctions module.
     """
-    port = simpledialog.askstring("USB Port", "What USB-Port are you using? (e.g 6 if you use COM6)")
-    if port:
+    found = pf.discoverInstrument()
+    if found:
+        print(f"Found {found[1]} at {found[0]}")
+        return
+    port = simpledialog.askstring("USB Port", "What USB-Port are you using? (e.g 6 if you use COM6, SIM for a simulated device)")
+    if port and port.strip().upper() == "SIM":
+        pf.useSimulatedInstrument()
+        messagebox.showinfo("USB Port is set", "You are using a simulated device.")
+    elif port:
         messagebox.showinfo("USB Port is set", f"You are using: COM{port}")
-        pf.usbPort = int(port)
+        pf.setUsbPort(port)
     else:
         messagebox.showwarning("No Port", "No valid port.")
 
@@ -55,19 +61,58 @@ def on_load_profile():
                 toggle_output()
             else:
                 return
-        # Call loadProfile with the converted values, including burst mode and single pulse.
-        pf.loadProfile(signal_var.get(), amp, drop_amp, peak_time, drop_time, delta_t,
-                       burst_var.get(), single_pulse_var.get(), ax, canvas)
-        global triggerActive
-        triggerActive = True
+        # Compute the profile with the converted values, including single pulse.
+        profile = pf.buildProfile(signal_var.get(), amp, drop_amp, peak_time, drop_time, delta_t, single_pulse_var.get())
+        if profile is None:
+            return
     except Exception as e:
         messagebox.showerror("Error", f"Conversion error: {str(e)}")
+        return
+
+    def on_loaded(result):
+        global triggerActive
+        triggerActive = True
+        load_button.state(["!disabled"])
+
+    def on_load_failed(error):
+        load_button.state(["!disabled"])
+        show_device_error(error)
+
+    load_button.state(["disabled"])
+    worker.submit(pf.applyProfile, profile, burst_var.get(), withProgress=True,
+                  onDone=on_loaded, onError=on_load_failed, onProgress=set_status,
+                  timeoutSeconds=pf.loadTimeSeconds + 2 * pf.completionTimeoutSeconds + 5, name="Load Profile")
+    # Draw the pulse while the worker loads it onto the device.
+    setup_plot()
+    pf.updatePlot(ax, canvas, profile["pulse"], profile["duration"], profile["plotType"])
 
 def on_trigger():
-    if messagebox.askyesno("No profile loaded yet.", "This will try to load a profile of a previous session. This may fail. Do you want to continue?"):
-        pf.sendTrigger()
+    if triggerActive or messagebox.askyesno("No profile loaded yet.", "This will try to load a profile of a previous session. This may fail. Do you want to continue?"):
+        run_on_device(pf.sendTrigger, name="Send Impuls")
     else: return
 
+def on_trigger_train():
+    """
+    Sends a train of triggers with the count and interval of the entry fields and shows the timing statistics.
+    """
+    try:
+        count = int(pf.safe_float(train_count_entry.get(), "Train Count"))
+        interval = pf.safe_float(train_interval_entry.get(), "Train Interval")
+        if train_interval_unit.get() == "ms":
+            interval /= 1000.0
+    except Exception as e:
+        messagebox.showerror("Error", f"Conversion error: {str(e)}")
+        return
+
+    def on_train_done(result):
+        set_status(f"Sent {result['count']} triggers: mean interval {result['meanInterval'] * 1000:.3f} ms, "
+                   f"jitter {result['jitter'] * 1000:.3f} ms, drift {result['drift'] * 1000:.3f} ms")
+
+    if triggerActive or messagebox.askyesno("No profile loaded yet.", "This will try to load a profile of a previous session. This may fail. Do you want to continue?"):
+        worker.submit(pf.sendTriggerTrain, count, interval, withProgress=True,
+                      onDone=on_train_done, onError=show_device_error, onProgress=set_status,
+                      timeoutSeconds=count * interval + 10, name="Send Train")
+
 def on_reset():
     """
     Asks for confirmation before sending an impulse that should "reset" the device.
@@ -75,23 +120,92 @@ def on_reset():
     if messagebox.askyesno("Confirmation", "Do you really want to execute Erase?"):
         duration = float(reset_duration_entry.get())
         amplitude = reset_amplitude_entry.get()
-        pf.sendReset(durationSeconds=duration, amplitude=amplitude)
         print("Resetting device.")
+        run_on_device(pf.sendReset, durationSeconds=duration, amplitude=amplitude,
+                      timeoutSeconds=duration + 10, name="Reset Device")
 
 def toggle_output():
     """
     Toggles the output state. Calls pf.turnOnOutput() when turning on and
-    pf.turnOffOutput() when turning off. Also changes the button color.
+    pf.turnOffOutput() when turning off. The state and the button color only
+    change once the device has switched the output.
     """
-    global output_state
-    if not output_state:
-        pf.turnOnOutput()
-        output_state = True
-        output_button.config(style="OutputOn.TButton")
-    else:
-        pf.turnOffOutput()
-        output_state = False
-        output_button.config(style="OutputOff.TButton")
+    turnOn = not output_state
+    name = "Output on" if turnOn else "Output off"
+
+    def on_output_done(result):
+        global output_state
+        output_state = turnOn
+        output_button.config(style="OutputOn.TButton" if turnOn else "OutputOff.TButton")
+        set_status(f"{name} done.")
+
+    set_status(f"{name}...")
+    worker.submit(pf.turnOnOutput if turnOn else pf.turnOffOutput, onDone=on_output_done,
+                  onError=show_device_error, timeoutSeconds=15, name=name)
+
+def set_status(message):
+    """Shows a status message of the instrument worker below the buttons."""
+    status_var.set(message)
+
+def show_device_error(error):
+    """Shows an error of a device command (called on the Tk main thread)."""
+    set_status(f"Error: {error}")
+    if not isinstance(error, CancelledError):
+        messagebox.showerror("Device Error", str(error))
+
+def run_on_device(func, *args, name=None, timeoutSeconds=15, **kwargs):
+    """Queues a device command on the instrument worker and reports its state in the status line."""
+    name = name or func.__name__
+    set_status(f"{name}...")
+    return worker.submit(func, *args, onDone=lambda result: set_status(f"{name} done."),
+                         onError=show_device_error, timeoutSeconds=timeoutSeconds, name=name, **kwargs)
+
+def on_cancel():
+    """Cancels the running and all waiting device commands."""
+    worker.cancelAll()
+    load_button.state(["!disabled"])
+    set_status("Cancelled.")
+
+def open_stats_panel():
+    """
+    Opens a window with the live statistics of all SCPI commands and pipeline stages.
+    Tracing is enabled while the window is open.
+    """
+    panel = tk.Toplevel(root)
+    panel.title("Command Statistics")
+    text = tk.Text(panel, width=100, height=25, font=("Courier", 10))
+    text.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+    buttons = ttk.Frame(panel, padding=(5, 5, 5, 5))
+    buttons.pack(side=tk.BOTTOM, fill=tk.X)
+
+    def export(kind):
+        path = filedialog.asksaveasfilename(parent=panel, defaultextension=f".{kind}", filetypes=[(kind.upper(), f"*.{kind}")])
+        if path:
+            tracer.exportJson(path) if kind == "json" else tracer.exportCsv(path)
+
+    ttk.Button(buttons, text="Export JSON", command=lambda: export("json")).pack(side=tk.LEFT, padx=5)
+    ttk.Button(buttons, text="Export CSV", command=lambda: export("csv")).pack(side=tk.LEFT, padx=5)
+    ttk.Button(buttons, text="Reset", command=tracer.reset).pack(side=tk.LEFT, padx=5)
+
+    def refresh():
+        if not panel.winfo_exists():
+            return
+        text.delete("1.0", tk.END)
+        text.insert(tk.END, tracer.formatSummary())
+        panel.after(500, refresh)
+
+    def close():
+        tracer.enabled = False
+        panel.destroy()
+
+    panel.protocol("WM_DELETE_WINDOW", close)
+    tracer.enabled = True
+    refresh()
+
+def on_close():
+    """Stops the instrument worker and closes the window without waiting for the device."""
+    worker.stop()
+    root.destroy()
 
 # --- Main Window Setup ---
 
@@ -106,6 +220,10 @@ root.minsize(800, 500)
 # Set fixed window size (non-resizable)
 root.resizable(False, False)
 root.configure(bg="#f0f0f0")
+root.protocol("WM_DELETE_WINDOW", on_close)
+
+# Worker thread for all device commands, so the window never waits for the instrument.
+worker = InstrumentWorker(root)
 
 # --- TTK Style Configuration ---
 
@@ -140,12 +258,29 @@ plot_frame.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True)
 
 # --- Matplotlib Plot Setup ---
 
-# Create the matplotlib Figure and embed it into the plot_frame.
-fig = Figure(figsize=(5, 4), dpi=100)
-ax = fig.add_subplot(111)
-canvas = FigureCanvasTkAgg(fig, master=plot_frame)
-canvas.draw()
-canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+# The plot is created after the window is shown, because importing matplotlib takes a while.
+ax = None
+canvas = None
+
+def setup_plot():
+    """
+    Creates the matplotlib Figure and embeds it into the plot_frame (only once).
+    """
+    global ax, canvas
+    if ax is not None:
+        return
+    import matplotlib
+    matplotlib.use("TkAgg")
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(5, 4), dpi=100)
+    ax = fig.add_subplot(111)
+    canvas = FigureCanvasTkAgg(fig, master=plot_frame)
+    canvas.draw()
+    canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+
+root.after(1, setup_plot)
 
 # --- Helper Function for Labeled Entry Creation ---
 
@@ -179,11 +314,11 @@ def add_labeled_entry(frame, label_text, row, unit_options=None, default_unit=No
 
 # --- UI Elements in the Control Frame ---
 
-# Signal Type Dropdown (allowed profiles: "Square", "Triangle")
+# Signal Type Dropdown (allowed profiles: "Square" and the pulse families of wavefunctions)
 signal_var = tk.StringVar(value="Square")
 ttk.Label(control_frame, text="Signal Type:").grid(row=0, column=0, padx=5, pady=5, sticky="w")
 signal_dropdown = ttk.Combobox(control_frame, textvariable=signal_var,
-                               values=["Square"], # Add new profiles here if needed. Removed all others except Square
+                               values=["Square"] + list(pf.pulseFamilies), # New profiles are added in pf.pulseFamilies
                                state="readonly")
 signal_dropdown.grid(row=0, column=1, columnspan=2, padx=5, pady=5, sticky="ew")
 
@@ -203,12 +338,18 @@ droptime_entry.insert(0, "7")
 delta_t_entry, delta_t_unit = add_labeled_entry(control_frame, "Delta t:", 5, ["ms", "µs"], "ms")
 delta_t_entry.insert(0, "1")
 
+train_interval_entry, train_interval_unit = add_labeled_entry(control_frame, "Train Interval:", 6, ["ms", "s"], "ms")
+train_interval_entry.insert(0, "100")  # Default value
+
 reset_amplitude_entry, reset_amplitude_unit = add_labeled_entry(control_frame, "Reset Amplitude:", 7, ["V", "mV"], "V")
 reset_amplitude_entry.insert(0, "1")  # Default value
 
 reset_duration_entry, reset_duration_unit = add_labeled_entry(control_frame, "Reset Duration:", 8, ["s"], "s")
 reset_duration_entry.insert(0, "2")  # Default value
 
+train_count_entry, _ = add_labeled_entry(control_frame, "Train Count:", 9)
+train_count_entry.insert(0, "10")  # Default value
+
 # Burst-Mode Checkbox.
 burst_var = tk.BooleanVar(value=True)
 burst_check = ttk.Checkbutton(control_frame, text="Burst-Mode", variable=burst_var)
@@ -227,6 +368,10 @@ load_button.grid(row=11, column=2, padx=5, pady=6, sticky="ew")
 send_button = ttk.Button(control_frame, text="Send Impuls", command=lambda: on_trigger(), style="Send.TButton")
 send_button.grid(row=12, column=1, padx=5, pady=6, sticky="ew")
 
+# Send Train Button: sends "Train Count" triggers every "Train Interval".
+train_button = ttk.Button(control_frame, text="Send Train", command=on_trigger_train, style="Send.TButton")
+train_button.grid(row=12, column=0, padx=5, pady=6, sticky="ew")
+
 # Reset Button with custom red style.
 reset_button = ttk.Button(control_frame, text="Reset Device", command=on_reset, style="Reset.TButton")
 reset_button.grid(row=12, column=2, padx=5, pady=6, sticky="ew")
@@ -235,8 +380,23 @@ reset_button.grid(row=12, column=2, padx=5, pady=6, sticky="ew")
 output_button = ttk.Button(control_frame, text="Output", command=toggle_output, style="OutputOff.TButton")
 output_button.grid(row=13, column=2, padx=5, pady=6, sticky="ew")
 
+# Cancel Button: stops the running and all waiting device commands.
+cancel_button = ttk.Button(control_frame, text="Cancel", command=on_cancel)
+cancel_button.grid(row=13, column=1, padx=5, pady=6, sticky="ew")
+
+# Stats Button: opens the live statistics of the device commands.
+stats_button = ttk.Button(control_frame, text="Stats", command=open_stats_panel)
+stats_button.grid(row=13, column=0, padx=5, pady=6, sticky="ew")
+
+# Status line for the device commands.
+status_var = tk.StringVar(value="")
+status_label = ttk.Label(control_frame, textvariable=status_var)
+status_label.grid(row=14, column=0, columnspan=3, padx=5, pady=5, sticky="w")
+
 # Ensure the output is turned off at startup.
-pf.turnOffOutput()
+run_on_device(pf.turnOffOutput, name="Output off")
 
 # --- Main Event Loop ---
 root.mainloop()
+if not worker.busy(): # A busy worker may hold the session; it is a daemon thread and ends with the program.
+    pf.session.close()
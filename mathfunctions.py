@@ -1,5 +1,11 @@
 import numpy as np
+import math
+from functools import reduce, lru_cache
+from tracing import traced
 
+DAC_MAX = 8191 # Largest DAC code of the 33220A (14-bit, symmetric around 0)
+
+@traced("math")
 def generateSQUSQU(amplitude1, amplitude2, uptime, downtime, periodInMilliseconds=10, factor=1, returnArray=True):
     """
     Generates a square-like (step) waveform and extends its total length by repeating each point.
@@ -25,30 +31,94 @@ def generateSQUSQU(amplitude1, amplitude2, uptime, downtime, periodInMillisecond
     Returns:
       np.array or str: The extended waveform.
     """
-    # Generate the original signal
+    # Segment boundaries in points of the original signal. A point i belongs to a segment
+    # while i < boundary, so fractional boundaries are rounded up (same as the point-wise loop).
     original_length = int(round(periodInMilliseconds))
-    result = []
-    for i in range(original_length):
-        if 0 <= i < uptime:
-            result.append(amplitude1)
-        elif uptime <= i < (uptime + downtime):
-            result.append(-amplitude2)
-        else:
-            result.append(0)
-    
-    # Convert to a NumPy array
-    result = np.array(result, dtype=float)
-    
-    # Extend the signal by repeating each element 'factor' times if factor > 1
-    if factor > 1:
-        result = np.repeat(result, factor)
-    
+    repeat = int(factor) if factor > 1 else 1
+    upEnd = min(max(int(np.ceil(uptime)), 0), original_length)
+    downEnd = min(max(int(np.ceil(uptime + downtime)), upEnd), original_length)
+
+    # Write the segments straight into the extended array (each point repeated 'factor' times)
+    result = np.zeros(original_length * repeat, dtype=float)
+    result[:upEnd * repeat] = amplitude1
+    result[upEnd * repeat:downEnd * repeat] = -amplitude2
+
     # Return the waveform in the requested format
     if returnArray:
         return result
     else:
         return ",".join(map(str, result))
 
+@traced("math")
+def generateSQUSQUBatch(amplitude1, amplitude2, uptime, downtime, periodInMilliseconds=10, factor=1):
+    """
+    Generates many square-like (step) waveforms at once, see generateSQUSQU.
+
+    All parameters may be scalars or 1-D arrays; they are broadcast against each other and
+    every row of the result is the waveform for one parameter set. Rows with a shorter period
+    than the longest one are padded with 0 (the idle value) at the end.
+
+    Parameters:
+      amplitude1 (float or array-like): Amplitudes for the first segment.
+      amplitude2 (float or array-like): Amplitudes for the second segment (negative level).
+      uptime (float or array-like): Number of points with amplitude1.
+      downtime (float or array-like): Number of points with -amplitude2.
+      periodInMilliseconds (float or array-like, optional): Number of points in the original waveforms.
+      factor (int, optional): Factor by which to extend the total number of points (each point is repeated).
+
+    Returns:
+      np.ndarray: 2-D array with one waveform per row.
+    """
+    amplitude1, amplitude2, uptime, downtime, period = np.broadcast_arrays(
+        *(np.atleast_1d(np.asarray(value, dtype=float))
+          for value in (amplitude1, amplitude2, uptime, downtime, periodInMilliseconds)))
+    repeat = int(factor) if factor > 1 else 1
+
+    # Segment boundaries per row, in points of the extended waveform
+    original_length = np.round(period).astype(int)
+    upEnd = np.clip(np.ceil(uptime).astype(int), 0, original_length)
+    downEnd = np.clip(np.ceil(uptime + downtime).astype(int), upEnd, original_length)
+
+    # Fill the whole matrix in one pass by comparing each column index against the boundaries
+    position = np.arange(int(original_length.max(initial=0)) * repeat)
+    result = np.zeros((len(original_length), len(position)), dtype=float)
+    np.copyto(result, amplitude1[:, None], where=position < (upEnd * repeat)[:, None])
+    np.copyto(result, -amplitude2[:, None],
+              where=(position >= (upEnd * repeat)[:, None]) & (position < (downEnd * repeat)[:, None]))
+    return result
+
+def getMinimalTimeStep(*durations, resolution=0.001, minPoints=1, maxStep=None):
+    """
+    Returns the longest time step at which every duration is a whole number of points.
+
+    A step (square) pulse only needs enough points to place its edges exactly, so the step is
+    the greatest common divisor of all segment durations. Durations are rounded to 'resolution'
+    first. If the resulting waveform would have fewer than 'minPoints' points, the step is
+    divided by the smallest integer that reaches 'minPoints' (so the edges stay exact), and the
+    same is done to keep the step at or below 'maxStep'.
+
+    For durations 3 ms, 7 ms and 1 ms the step is 1 ms (11 points instead of 2200 with a fixed
+    factor of 200); for 3 ms, 7 ms and 0.25 ms it is 0.25 ms.
+
+    Parameters:
+        *durations (float): The segment durations (e.g. spike time, reference time, delta t).
+        resolution (float, optional): Time resolution the durations are rounded to (same unit as durations).
+        minPoints (int, optional): Minimum number of points of the waveform covering all durations.
+        maxStep (float, optional): Longest allowed time step (same unit as durations).
+
+    Returns:
+        float: The time step (same unit as durations).
+    """
+    units = [int(round(abs(duration) / resolution)) for duration in durations]
+    stepUnits = reduce(math.gcd, units, 0)
+    if stepUnits == 0:
+        raise ValueError("At least one duration must be longer than the resolution.")
+    divider = max(1, math.ceil(minPoints * stepUnits / sum(units)))
+    if maxStep:
+        divider = max(divider, math.ceil(stepUnits * resolution / maxStep - 1e-9)) # Tolerance against float noise of maxStep / resolution
+    return stepUnits * resolution / divider
+
+@traced("math")
 def getPulseDifference(pulse, delta=0):
     """
     Generates the difference between a pulse and a shifted version of itself.
@@ -86,6 +156,176 @@ def getPulseDifference(pulse, delta=0):
 
     return extended_pulse - shifted_pulse
 
+def getSquareSegments(amplitude1, amplitude2, uptime, downtime, delta=None, periodInMilliseconds=None):
+    """
+    Returns the constant segments of a square pulse (see generateSQUSQU) or of its difference
+    with a shifted copy (see getPulseDifference) without building any array.
+
+    Both waveforms are step functions, so they are fully described by a few (start, end, value)
+    segments. The points agree exactly with getPulseDifference(generateSQUSQU(...), delta).
+
+    Parameters:
+        amplitude1 (float): Amplitude for the first segment.
+        amplitude2 (float): Amplitude for the second segment (negative level).
+        uptime (int): Number of points with amplitude1.
+        downtime (int): Number of points with -amplitude2.
+        delta (int, optional): Shift in points of the subtracted copy. None for the single pulse.
+        periodInMilliseconds (int, optional): Number of points of the pulse. Defaults to uptime + downtime.
+
+    Returns:
+        tuple: (segments, length) with the list of (start, end, value) segments in points and
+               the total number of points.
+    """
+    period = uptime + downtime if periodInMilliseconds is None else periodInMilliseconds
+    original_length = int(round(period))
+    upEnd = min(max(int(math.ceil(uptime)), 0), original_length)
+    downEnd = min(max(int(math.ceil(uptime + downtime)), upEnd), original_length)
+
+    def pulseValue(i):
+        if 0 <= i < upEnd:
+            return float(amplitude1)
+        if upEnd <= i < downEnd:
+            return -float(amplitude2)
+        return 0.0
+
+    if delta is None:
+        length = original_length
+        edges = {0, upEnd, downEnd, length}
+        value = pulseValue
+    else:
+        delta = int(delta)
+        length = original_length + abs(delta)
+        edges = {0, upEnd, downEnd, delta, upEnd + delta, downEnd + delta, length}
+        value = lambda i: pulseValue(i) - pulseValue(i - delta)
+
+    segments = []
+    edges = sorted(edge for edge in edges if 0 <= edge <= length)
+    for start, end in zip(edges, edges[1:]):
+        level = value(start)
+        if segments and segments[-1][2] == level:
+            segments[-1] = (segments[-1][0], end, level) # Merge equal neighbours
+        else:
+            segments.append((start, end, level))
+    return segments, length
+
+def fillSegments(segments, length, out=None, dtype=np.float64, leadingZero=False):
+    """
+    Writes constant segments (see getSquareSegments) into an array with one slice assignment each.
+
+    Parameters:
+        segments (list): The (start, end, value) segments.
+        length (int): Number of points covered by the segments.
+        out (np.ndarray, optional): Buffer to reuse (at least length (+1) points). The result is a view of it.
+        dtype (np.dtype, optional): Type of a newly allocated array (e.g. np.float32 or np.int16).
+        leadingZero (bool, optional): If True, an extra 0 point is put in front of the segments.
+
+    Returns:
+        np.ndarray: The waveform.
+    """
+    first = 1 if leadingZero else 0
+    result = np.empty(length + first, dtype=dtype) if out is None else out[:length + first]
+    if len(result) != length + first:
+        raise ValueError(f"Buffer too small for {length + first} points.")
+    result[:first] = 0
+    for start, end, level in segments:
+        result[first + start:first + end] = level
+    return result
+
+@traced("math")
+def createSquareArb(amplitude1, amplitude2, uptime, downtime, delta=None, leadingZero=True, out=None):
+    """
+    Fused version of generateSQUSQU -> getPulseDifference -> createArbDac for square pulses.
+
+    The normalization only needs the few levels of the step function, so every level is turned
+    into its DAC code once and the codes are written straight into a single int16 array.
+    No float waveform and no intermediate copies are created; pass 'out' to reuse a buffer
+    across calls. The codes equal createArbDac(np.insert(pulse, 0, 0.0)) of the slow path.
+
+    Parameters:
+        amplitude1 (float): Amplitude for the first segment.
+        amplitude2 (float): Amplitude for the second segment (negative level).
+        uptime (int): Number of points with amplitude1.
+        downtime (int): Number of points with -amplitude2.
+        delta (int, optional): Shift in points of the subtracted copy. None for the single pulse.
+        leadingZero (bool, optional): If True, a 0 V point is put in front (the idle value in burst mode).
+        out (np.ndarray, optional): int16 buffer to reuse. The returned codes are a view of it.
+
+    Returns:
+        tuple: A tuple containing:
+            - dac_codes (np.ndarray): The DAC codes as int16.
+            - amplitude (float): The calculated peak-to-peak amplitude.
+            - offset (float): The calculated DC offset.
+    """
+    segments, length = getSquareSegments(amplitude1, amplitude2, uptime, downtime, delta)
+    levels = [level for _, _, level in segments] + ([0.0] if leadingZero else [])
+    if not levels:
+        raise ValueError("Pulse has no points.")
+    amplitude = max(levels) - min(levels)
+    offset = (max(levels) + min(levels)) / 2.0
+    if amplitude == 0:
+        raise ValueError("Pulse has zero amplitude; cannot normalize.")
+
+    # Same arithmetic as normalizePulse and createArbDac, but once per level instead of once per point
+    code = lambda level: int(np.rint((level - offset) / (amplitude / 2) * DAC_MAX))
+    codes = [(start, end, code(level)) for start, end, level in segments]
+    result = fillSegments(codes, length, out=out, dtype=np.int16, leadingZero=leadingZero)
+    if leadingZero:
+        result[0] = code(0.0)
+    return result, amplitude, offset
+
+def normalizePulse(pulse, startValue=None, out=None):
+    """
+    Normalizes the desired output voltages to the range [-1, 1] expected by the 33220A.
+    See createArbString for the details of the normalization and the startValue handling.
+
+    Parameters:
+        pulse (list or array-like): The desired output voltages.
+        startValue (float, optional): The desired voltage for the first point in the pulse.
+                                      Must be within the range of the pulse.
+        out (np.ndarray, optional): Float array the result is written to. May be the pulse itself
+                                    to normalize in place. By default a new array is allocated
+                                    (float32 pulses stay float32, everything else becomes float64).
+
+    Returns:
+        tuple: A tuple containing:
+            - norm_pulse (np.ndarray): The normalized waveform.
+            - amplitude (float): The calculated peak-to-peak amplitude.
+            - offset (float): The calculated DC offset.
+    """
+    # Convert the input pulse to a numpy array of floats (no copy if it already is one)
+    pulse = np.asarray(pulse)
+    if pulse.dtype not in (np.float32, np.float64):
+        pulse = pulse.astype(float)
+    
+    # Determine the minimum and maximum values in the pulse
+    pulse_min = float(np.min(pulse))
+    pulse_max = float(np.max(pulse))
+    
+    # Calculate the amplitude (Vpp) and DC offset
+    amplitude = pulse_max - pulse_min
+    offset = (pulse_max + pulse_min) / 2.0
+    
+    # Check for constant pulse (zero amplitude)
+    if amplitude == 0:
+        raise ValueError("Pulse has zero amplitude; cannot normalize.")
+    
+    # Normalize the pulse to the range [-1, 1] using the derived amplitude and offset.
+    # Both steps run in place on one array, so no temporary arrays are created.
+    norm_pulse = np.subtract(pulse, offset, out=out, dtype=out.dtype if out is not None else pulse.dtype)
+    norm_pulse /= amplitude / 2
+    
+    # If a startValue is provided, override the first normalized value.
+    # Ensure that startValue is within the original pulse range.
+    if startValue is not None:
+        if not (pulse_min <= startValue <= pulse_max):
+            raise ValueError("startValue must be within the range of the pulse values.")
+        # Calculate the normalized value corresponding to the provided startValue.
+        norm_start = (startValue - offset) / (amplitude / 2)
+        norm_pulse[0] = norm_start
+
+    return norm_pulse, amplitude, offset
+
+@traced("math")
 def createArbString(pulse, startValue=None):
     """
     Converts the desired output voltages into a normalized waveform string for the 33220A.
@@ -120,35 +360,252 @@ def createArbString(pulse, startValue=None):
             - amplitude (float): The calculated peak-to-peak amplitude.
             - offset (float): The calculated DC offset.
     """
-    # Convert the input pulse to a numpy array of floats
-    pulse = np.array(pulse, dtype=float)
-    
-    # Determine the minimum and maximum values in the pulse
-    pulse_min = np.min(pulse)
-    pulse_max = np.max(pulse)
-    
-    # Calculate the amplitude (Vpp) and DC offset
-    amplitude = pulse_max - pulse_min
-    offset = (pulse_max + pulse_min) / 2.0
-    
-    # Check for constant pulse (zero amplitude)
-    if amplitude == 0:
-        raise ValueError("Pulse has zero amplitude; cannot normalize.")
+    norm_pulse, amplitude, offset = normalizePulse(pulse, startValue)
     
-    # Normalize the pulse to the range [-1, 1] using the derived amplitude and offset
-    norm_pulse = (pulse - offset) / (amplitude / 2)
-    
-    # If a startValue is provided, override the first normalized value.
-    # Ensure that startValue is within the original pulse range.
-    if startValue is not None:
-        if not (pulse_min <= startValue <= pulse_max):
-            raise ValueError("startValue must be within the range of the pulse values.")
-        # Calculate the normalized value corresponding to the provided startValue.
-        norm_start = (startValue - offset) / (amplitude / 2)
-        norm_pulse[0] = norm_start
-    
-    # Format the normalized values as a comma-separated string (adjust precision as needed)
-    normalized_str = ','.join(f'{x:.6f}' for x in norm_pulse)
+    # Format the normalized values as a comma-separated string (6 decimals)
+    normalized_str = encodeArbText(norm_pulse)
     
     return normalized_str, amplitude, offset
 
+def encodeArbText(normalized):
+    """
+    Formats normalized values in [-1, 1] as a comma-separated string with 6 decimals.
+
+    Gives the same text as ','.join(f'{x:.6f}' for x in normalized), but the characters are
+    assembled with numpy as a fixed width byte matrix ("-d.dddddd,") instead of formatting one
+    Python string per point. Positive values drop their sign column.
+
+    Parameters:
+        normalized (array-like): The normalized waveform, every value within [-1, 1].
+
+    Returns:
+        str: The comma-separated values.
+    """
+    normalized = np.asarray(normalized, dtype=float).ravel()
+    if len(normalized) == 0:
+        return ""
+    micro = np.rint(np.abs(normalized) * 1e6).astype(np.int64) # Magnitude in millionths
+    if micro.max() > 9999999:
+        raise ValueError("Values must be within [-9.999999, 9.999999].")
+
+    chars = np.empty((len(normalized), 10), dtype=np.uint8)
+    chars[:, 0] = ord("-")
+    chars[:, 1] = micro // 1000000 + ord("0")
+    chars[:, 2] = ord(".")
+    for column, power in enumerate(range(5, -1, -1), start=3):
+        chars[:, column] = (micro // 10**power) % 10 + ord("0")
+    chars[:, 9] = ord(",")
+
+    keep = np.ones(chars.shape, dtype=bool)
+    keep[:, 0] = np.signbit(normalized) # Negative values (also -0.0) keep their sign like the f-string
+    return chars[keep][:-1].tobytes().decode("ascii")
+
+@traced("math")
+def createArbDac(pulse, startValue=None, inPlace=False, out=None):
+    """
+    Converts the desired output voltages into 14-bit DAC codes for the 33220A.
+    The pulse is normalized exactly like in createArbString and then quantized to the
+    integer range [-8191, 8191] accepted by DATA:DAC.
+
+    Parameters:
+        pulse (list or array-like): The desired output voltages.
+        startValue (float, optional): The desired voltage for the first point in the pulse.
+                                      Must be within the range of the pulse.
+        inPlace (bool, optional): If True, the pulse (a float array) is used as scratch buffer and
+                                  overwritten, so no float copy is made.
+        out (np.ndarray, optional): int16 buffer for the codes (at least as long as the pulse).
+                                    The returned codes are a view of it.
+
+    Returns:
+        tuple: A tuple containing:
+            - dac_codes (np.ndarray): The DAC codes as int16.
+            - amplitude (float): The calculated peak-to-peak amplitude.
+            - offset (float): The calculated DC offset.
+    """
+    inPlace = inPlace and isinstance(pulse, np.ndarray) and pulse.dtype in (np.float32, np.float64)
+    norm_pulse, amplitude, offset = normalizePulse(pulse, startValue, out=pulse if inPlace else None)
+    norm_pulse *= DAC_MAX
+    np.rint(norm_pulse, out=norm_pulse)
+    dac_codes = np.empty(len(norm_pulse), dtype=np.int16) if out is None else out[:len(norm_pulse)]
+    dac_codes[...] = norm_pulse
+    return dac_codes, amplitude, offset
+
+@traced("math")
+def createDacBlock(dacCodes, bigEndian=True):
+    """
+    Packs DAC codes into an IEEE-488.2 definite length binary block (#<n><length><data>).
+
+    Parameters:
+        dacCodes (array-like): The DAC codes in the range [-8191, 8191].
+        bigEndian (bool, optional): Byte order of the data. Must match the FORM:BORD setting
+                                    of the device (NORM = big endian, SWAP = little endian).
+
+    Returns:
+        bytes: The binary block including its header.
+    """
+    data = np.asarray(dacCodes, dtype=">i2" if bigEndian else "<i2").tobytes()
+    length = str(len(data))
+    return f"#{len(length)}{length}".encode("ascii") + data
+
+def getArbAttributes(dacCodes):
+    """
+    Computes the values the device reports for a stored arb (DATA:ATTR:POIN?, AVER? and PTP?),
+    so an upload can be checked without reading the waveform back.
+
+    Parameters:
+        dacCodes (array-like): The DAC codes in the range [-8191, 8191]. Normalized values can be
+                               converted with np.rint(values * DAC_MAX), which is what the device stores.
+
+    Returns:
+        dict: "points", "average" and "peakToPeak" (average and peak to peak in the normalized range [-1, 1]).
+    """
+    dacCodes = np.asarray(dacCodes)
+    return {"points": len(dacCodes),
+            "average": float(dacCodes.mean(dtype=np.float64)) / DAC_MAX,
+            "peakToPeak": (int(dacCodes.max()) - int(dacCodes.min())) / DAC_MAX}
+
+SEGMENT_KINDS = ("const", "ramp", "exp") # Segment types of a piecewise waveform description, see compilePiecewise
+
+class CompiledWaveform:
+    """
+    A piecewise waveform compiled for one time step (see compilePiecewise).
+    Every segment is stored as its position in points and its coefficients, so sampling only
+    runs one vectorized numpy expression per segment.
+    """
+
+    def __init__(self, kinds, starts, lengths, coefficients, timeStep):
+        self.kinds = kinds
+        self.starts = starts
+        self.lengths = lengths
+        self.coefficients = coefficients # (start level, end level, time constant in points) per segment
+        self.timeStep = timeStep
+        self.length = int(sum(lengths))
+
+    def sample(self, delta=None, leadingZero=False, out=None, dtype=np.float64):
+        """
+        Samples the waveform, optionally as difference with a copy shifted by delta points
+        (same as getPulseDifference).
+
+        Parameters:
+            delta (int, optional): Shift in points of the subtracted copy. None for the single pulse.
+            leadingZero (bool, optional): If True, an extra 0 point is put in front.
+            out (np.ndarray, optional): Buffer to reuse. The result is a view of it.
+            dtype (np.dtype, optional): Type of a newly allocated array.
+
+        Returns:
+            np.ndarray: The samples.
+        """
+        first = 1 if leadingZero else 0
+        total = self.length + (abs(int(delta)) if delta is not None else 0)
+        result = np.empty(first + total, dtype=dtype) if out is None else out[:first + total]
+        if len(result) != first + total:
+            raise ValueError(f"Buffer too small for {first + total} points.")
+        result[:first] = 0
+        result[first + self.length:] = 0
+        for kind, start, length, (a, b, tau) in zip(self.kinds, self.starts, self.lengths, self.coefficients):
+            segment = result[first + start:first + start + length]
+            if kind == "const":
+                segment[...] = a
+            elif kind == "ramp":
+                segment[...] = np.arange(length) * ((b - a) / length) + a # Ends one point before b (the next segment starts there)
+            else:
+                segment[...] = np.exp(np.arange(length) * (-1.0 / tau)) * (a - b) + b
+
+        if delta is not None:
+            delta = int(delta)
+            pulse = result[first:first + self.length].copy()
+            if delta == 0:
+                result[first:] = 0
+            elif delta > 0:
+                result[first + delta:first + delta + self.length] -= pulse
+            else:
+                result[first:first + self.length + delta] -= pulse[-delta:]
+        return result
+
+@lru_cache(maxsize=128)
+def compilePiecewise(segments, timeStep):
+    """
+    Compiles a piecewise waveform description for the given time step. The result is memoized,
+    so a description that was used before costs nothing.
+
+    Every segment is a tuple (kind, duration, ...) with the duration in the unit of timeStep:
+      ("const", duration, level)
+      ("ramp", duration, startLevel, endLevel)      linear from startLevel towards endLevel
+      ("exp", duration, startLevel, endLevel, tau)   startLevel approaching endLevel with time constant tau
+
+    For a triangle of 1 ms up and 1 ms down:
+        compilePiecewise((("ramp", 1, 0, 2), ("ramp", 1, 2, 0)), 0.01)
+
+    Parameters:
+        segments (tuple): The segments (hashable, so tuples instead of lists).
+        timeStep (float): Duration of one point.
+
+    Returns:
+        CompiledWaveform: The compiled waveform.
+    """
+    kinds, starts, lengths, coefficients = [], [], [], []
+    position = 0
+    for segment in segments:
+        kind, duration = segment[0], segment[1]
+        if kind not in SEGMENT_KINDS:
+            raise ValueError(f"Unknown segment type {kind}.")
+        length = int(round(duration / timeStep))
+        if length <= 0:
+            continue # Shorter than one point
+        if kind == "const":
+            a, b, tau = float(segment[2]), float(segment[2]), 0.0
+        elif kind == "ramp":
+            a, b, tau = float(segment[2]), float(segment[3]), 0.0
+        else:
+            if segment[4] <= 0:
+                raise ValueError("The time constant of an exp segment must be positive.")
+            a, b, tau = float(segment[2]), float(segment[3]), segment[4] / timeStep
+        kinds.append(kind)
+        starts.append(position)
+        lengths.append(length)
+        coefficients.append((a, b, tau))
+        position += length
+    return CompiledWaveform(tuple(kinds), tuple(starts), tuple(lengths), tuple(coefficients), timeStep)
+
+def runLengthSteps(values, edges):
+    """
+    Merges runs of equal values of a step function, e.g. for plotting it with few stairs.
+
+    Parameters:
+        values (array-like): The value of every step (N values).
+        edges (array-like): The edges of the steps (N + 1 values).
+
+    Returns:
+        tuple: (values, edges) with one step per run of equal values.
+    """
+    values = np.asarray(values)
+    edges = np.asarray(edges)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(values)) + 1))
+    return values[starts], np.append(edges[starts], edges[-1])
+
+def minMaxDecimate(x, y, buckets):
+    """
+    Reduces a curve to the minimum and maximum of each of 'buckets' equally sized groups of points.
+    The extremes are kept in their original order, so the drawn envelope looks like the full curve
+    at a resolution of 'buckets' pixels.
+
+    Parameters:
+        x (array-like): The x values.
+        y (array-like): The y values.
+        buckets (int): Number of groups (e.g. the plot width in pixels).
+
+    Returns:
+        tuple: (x, y) with at most 2 * buckets points.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    buckets = max(int(buckets), 1)
+    if len(y) <= 2 * buckets:
+        return x, y
+    size = -(-len(y) // buckets) # Points per group (rounded up)
+    padded = np.pad(y, (0, size * buckets - len(y)), mode="edge").reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    indices = np.sort(np.stack((offsets + padded.argmin(axis=1), offsets + padded.argmax(axis=1)), axis=1), axis=1).ravel()
+    indices = np.minimum(indices, len(y) - 1)
+    return x[indices], y[indices]
+
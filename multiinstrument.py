@@ -0,0 +1,114 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import wavefunctions as pf
+
+class InstrumentGroupError(Exception):
+    """Raised when a command failed on some generators of a group. errors maps address -> exception."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(f"{address}: {error}" for address, error in errors.items()))
+
+class InstrumentGroup:
+    """
+    Several generators (each behind its own Prologix adapter) driven together.
+
+    Every generator gets its own InstrumentSession, so uploads, settings and waits run
+    concurrently on a thread pool and the setup time does not grow with the number of units.
+    The functions of wavefunctions are used for every unit (with instrument=<session>).
+    """
+
+    def __init__(self, addresses, resourceManager=None, timeoutMs=5000):
+        if not addresses:
+            raise ValueError("At least one address is needed.")
+        resourceManager = resourceManager or pf.session.resourceManager()
+        self.sessions = [pf.InstrumentSession(address, timeoutMs, resourceManager) for address in addresses]
+        self._pool = ThreadPoolExecutor(max_workers=len(self.sessions), thread_name_prefix="InstrumentGroup")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def close(self):
+        """Closes all connections and the thread pool."""
+        self._pool.shutdown(wait=True)
+        for session in self.sessions:
+            session.close()
+
+    def runAll(self, func, *args, **kwargs):
+        """
+        Runs func(*args, instrument=<session>, **kwargs) for all generators at the same time.
+
+        Returns:
+          list: The results in the order of the addresses.
+
+        Raises:
+          InstrumentGroupError: If func failed on any generator (after all others have finished).
+        """
+        futures = [self._pool.submit(func, *args, instrument=session, **kwargs) for session in self.sessions]
+        results, errors = [], {}
+        for session, future in zip(self.sessions, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(None)
+                errors[session.address] = e
+        if errors:
+            raise InstrumentGroupError(errors)
+        return results
+
+    def applyProfile(self, profile, burst=True):
+        """Loads a profile from wavefunctions.buildProfile onto all generators in parallel."""
+        return self.runAll(pf.applyProfile, profile, burst, progress=lambda message: None)
+
+    def prepareTrigger(self, frequency, amplitude, offset=0, cycle_count=1, start_phase=0):
+        """Applies the burst settings on all generators in parallel."""
+        return self.runAll(pf.prepareTrigger, frequency, amplitude, offset, cycle_count, start_phase)
+
+    def turnOnOutput(self):
+        return self.runAll(pf.turnOnOutput)
+
+    def turnOffOutput(self):
+        return self.runAll(pf.turnOffOutput)
+
+    def sendTrigger(self):
+        """
+        Sends *TRG to all generators as simultaneously as possible.
+
+        All connections are opened and locked before, then one thread per generator waits at a
+        barrier and writes the trigger as soon as it is released. The send times are measured
+        right before and after each write.
+
+        Returns:
+          dict: "sent" and "done" (times per address, seconds on time.perf_counter) and the skew
+                (largest difference between two generators) of both in seconds.
+        """
+        barrier = threading.Barrier(len(self.sessions))
+
+        def trigger(instrument):
+            with instrument:
+                try:
+                    pf.finishReset(instrument=instrument) # Select the pulse profile again after a reset
+                    instrument.open() # Connect before the barrier, so no unit pays the open cost
+                except Exception:
+                    barrier.abort() # Release the other units, the trigger would not be synchronous anyway
+                    raise
+                barrier.wait(timeout=instrument.timeoutMs / 1000)
+                sent = time.perf_counter()
+                instrument.write("*TRG")
+                done = time.perf_counter()
+                instrument.checkErrors() # E.g. a trigger ignored because the burst mode is off
+                return sent, done
+
+        times = dict(zip((session.address for session in self.sessions), self.runAll(trigger)))
+        sent = {address: value[0] for address, value in times.items()}
+        done = {address: value[1] for address, value in times.items()}
+        return {
+            "sent": sent,
+            "done": done,
+            "sentSkew": max(sent.values()) - min(sent.values()),
+            "doneSkew": max(done.values()) - min(done.values()),
+        }
@@ -0,0 +1,331 @@
+import re
+import threading
+import time
+import numpy as np
+import pyvisa
+
+BUILTIN_ARBS = ("EXP_RISE", "EXP_FALL", "NEG_RAMP", "SINC", "CARDIAC")
+VOWELS = "AEIOU"
+
+def shortForm(keyword):
+    """Returns the SCPI short form of a keyword (FREQuency -> FREQ, CATalog -> CAT)."""
+    keyword = keyword.upper()
+    if len(keyword) <= 4:
+        return keyword
+    return keyword[:3] if keyword[3] in VOWELS else keyword[:4]
+
+def normalizeHeader(header):
+    """Converts a SCPI header to its upper case short form (e.g. ':volt:offset?' -> 'VOLT:OFFS?')."""
+    query = header.endswith("?")
+    keywords = [shortForm(keyword) for keyword in header.rstrip("?").strip(":").split(":")]
+    return ":".join(keywords) + ("?" if query else "")
+
+def prologixUnescape(data: bytes):
+    """Removes the Prologix escape characters (ESC) in front of CR, LF, ESC and '+'."""
+    return re.sub(rb"\x1b(.)", rb"\1", data, flags=re.DOTALL)
+
+class SimulatedInstrument:
+    """
+    Simulated 33220A behind a Prologix GPIB-USB adapter.
+
+    Offers the part of the pyvisa resource interface used by InstrumentSession (write, write_raw,
+    query, read, close, timeout) and understands the SCPI subset used by this project. The arb
+    memory (volatile memory and the named non-volatile slots) and the burst/trigger state are modeled.
+
+    Every message costs commandLatencySeconds plus its size divided by bytesPerSecond. Copying an
+    arb into a slot keeps the device busy for copyBaseSeconds + copySecondsPerPoint * points;
+    *OPC? and every other query answer only after the device is no longer busy. Like through the
+    Prologix adapter, a single read waits at most adapterReadTimeoutMs; a read that timed out can be
+    repeated (after "++read eoi") and gets the answer once it is there.
+    With realtime=False nothing sleeps and the costs only add up in simulatedSeconds.
+    Like the real device, arb data is stored with 14-bit resolution. Set corruptUploads to let
+    the next uploads arrive without their last point (to test the upload verification).
+    """
+
+    def __init__(self, commandLatencySeconds=0.003, bytesPerSecond=50_000, copyBaseSeconds=0.2,
+                 copySecondsPerPoint=2e-5, arbSlots=4, realtime=True, idn="Agilent Technologies,33220A,SIM0000001,2.02-2.02-22-2"):
+        self.commandLatencySeconds = commandLatencySeconds
+        self.bytesPerSecond = bytesPerSecond
+        self.copyBaseSeconds = copyBaseSeconds
+        self.copySecondsPerPoint = copySecondsPerPoint
+        self.arbSlots = arbSlots
+        self.realtime = realtime
+        self.idn = idn
+        self.timeout = 5000 # Read timeout in milliseconds, like pyvisa resources
+        self.adapterReadTimeoutMs = 3000 # The adapter stops waiting for an answer after ++read_tmo_ms (at most 3 s)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Restores the power-on state, clears the arb memory and the statistics."""
+        self.volatile = None # Normalized points in volatile memory
+        self.arbs = {} # Non-volatile arbs: name -> normalized points
+        self.settings = {"FUNC": "SIN", "FUNC:USER": "EXP_RISE", "FREQ": 1000.0, "VOLT": 0.1, "VOLT:OFFS": 0.0,
+                         "VOLT:UNIT": "VPP", "BURS:NCYC": 1, "BURS:PHAS": 0.0, "BURS:MODE": "TRIG",
+                         "BURS:STAT": False, "TRIG:SOUR": "IMM", "OUTP": False, "FORM:BORD": "NORM"}
+        self.errors = []
+        self.triggers = [] # Times (simulated clock) of the triggers that started a burst
+        self.ignoredTriggers = 0
+        self.commands = [] # Every received command (without binary data)
+        self.bytesReceived = 0
+        self.bytesSent = 0
+        self.simulatedSeconds = 0.0
+        self._busyUntil = 0.0
+        self._answerReadyAt = 0.0 # The pending answer can be read from this time on
+        self._burstEnd = 0.0
+        self._pendingAnswer = None
+        self._esr = 0
+        self.corruptUploads = 0 # Number of following uploads that lose their last point
+
+    def now(self):
+        """Current time of the simulated clock."""
+        return time.perf_counter() if self.realtime else self.simulatedSeconds
+
+    def _spend(self, seconds):
+        self.simulatedSeconds += seconds
+        if self.realtime and seconds > 0:
+            time.sleep(seconds)
+
+    def _transfer(self, nbytes, received=True):
+        if received:
+            self.bytesReceived += nbytes
+        else:
+            self.bytesSent += nbytes
+        self._spend(self.commandLatencySeconds + nbytes / self.bytesPerSecond)
+
+
+    def _error(self, code, message):
+        self.errors.append(f'{code},"{message}"')
+
+    # --- pyvisa resource interface ---
+
+    def write(self, message):
+        with self._lock:
+            self._transfer(len(message) + 1)
+            self._handleMessage(message.strip())
+
+    def write_raw(self, data):
+        with self._lock:
+            self._transfer(len(data))
+            data = prologixUnescape(data.rstrip(b"\r\n"))
+            match = re.match(rb"\s*([A-Za-z:]+)\s+VOLATILE\s*,\s*#(\d)", data)
+            if match and normalizeHeader(match.group(1).decode()) == "DATA:DAC":
+                digits = int(match.group(2))
+                start = match.end() + digits
+                length = int(data[match.end():start])
+                dtype = ">i2" if self.settings["FORM:BORD"] == "NORM" else "<i2"
+                self.commands.append(f"DATA:DAC VOLATILE, <{length} bytes>")
+                self._storeVolatile(np.frombuffer(data[start:start + length], dtype=dtype) / 8191.0)
+            else:
+                self._handleMessage(data.decode("ascii", errors="replace"))
+
+    def read(self):
+        with self._lock:
+            timeoutMs = min(self.timeout, self.adapterReadTimeoutMs)
+            remaining = self._answerReadyAt - self.now()
+            if self._pendingAnswer is None or remaining * 1000 > timeoutMs:
+                self._spend(timeoutMs / 1000)
+                raise pyvisa.errors.VisaIOError(pyvisa.constants.StatusCode.error_timeout)
+            self._spend(max(0.0, remaining)) # The device answers only after finishing the pending commands
+            answer, self._pendingAnswer = self._pendingAnswer, None
+            self._transfer(len(answer) + 1, received=False)
+            return answer + "\n"
+
+    def query(self, message):
+        self.write(message)
+        return self.read()
+
+    def close(self):
+        pass
+
+    # --- SCPI handling ---
+
+    def _handleMessage(self, message):
+        if message.startswith("++"):
+            if message.strip() == "++ver":
+                self._pendingAnswer = "Prologix GPIB-USB Controller version 6.107 (simulated)"
+            return
+        answers = []
+        for command in message.split(";"):
+            command = command.strip()
+            if command:
+                self.commands.append(command)
+                answer = self._handleCommand(command)
+                if answer is not None:
+                    answers.append(answer)
+        if answers:
+            self._pendingAnswer = ";".join(answers) # Answers of several queries in one message are joined like on the device
+
+    def _handleCommand(self, command):
+        header, _, argument = command.partition(" ")
+        argument = argument.strip()
+        if header.lstrip(":").startswith("*") and not header.startswith("*"):
+            self._error(-113, "Undefined header") # Common commands must not have a leading colon (e.g. ":*TRG")
+            return None
+        if header.startswith("*"):
+            header = header.upper()
+        else:
+            header = normalizeHeader(header)
+
+        if header.endswith("?"):
+            self._answerReadyAt = self._busyUntil # Answered once the pending commands are finished, see read()
+            return self._handleQuery(header, argument)
+
+        if header == "*TRG":
+            self._trigger()
+        elif header == "*OPC":
+            self._esr |= 1
+        elif header in ("*RST", "*CLS"):
+            if header == "*RST":
+                self.settings.update({"FUNC": "SIN", "BURS:STAT": False, "OUTP": False})
+            self.errors.clear()
+        elif header == "DATA" or header == "DATA:DAC":
+            self._dataAscii(header, argument)
+        elif header == "DATA:COPY":
+            self._copy(argument)
+        elif header == "DATA:DEL":
+            name = argument.upper()
+            if name not in self.arbs:
+                self._error(-781, "Not found; arb waveform name not found")
+            elif self.settings["FUNC:USER"] == name:
+                self._error(-787, "Not able to delete the currently selected active arb waveform")
+            else:
+                del self.arbs[name]
+        elif header == "FUNC:USER":
+            name = argument.upper()
+            if name != "VOLATILE" and name not in self.arbs and name not in BUILTIN_ARBS:
+                self._error(-781, "Not found; arb waveform name not found")
+            elif name == "VOLATILE" and self.volatile is None:
+                self._error(-785, "Volatile arb waveform memory is empty")
+            else:
+                self.settings["FUNC:USER"] = name
+        elif header == "FUNC":
+            self.settings["FUNC"] = argument.upper()
+        elif header in ("FREQ", "VOLT", "VOLT:OFFS", "BURS:PHAS"):
+            self.settings[header] = self._number(argument)
+        elif header == "BURS:NCYC":
+            self.settings[header] = int(self._number(argument))
+        elif header in ("BURS:STAT", "OUTP"):
+            self.settings[header] = argument.upper() in ("ON", "1")
+        elif header in ("VOLT:UNIT", "BURS:MODE", "TRIG:SOUR", "FORM:BORD"):
+            self.settings[header] = argument.upper()
+        elif header == "APPL:USER":
+            values = [self._number(value) for value in argument.split(",")]
+            for key, value in zip(("FREQ", "VOLT", "VOLT:OFFS"), values):
+                self.settings[key] = value
+            self.settings["FUNC"] = "USER"
+        else:
+            self._error(-113, "Undefined header")
+
+    def _handleQuery(self, header, argument):
+        if header == "*IDN?":
+            return self.idn
+        if header == "*OPC?":
+            return "1"
+        if header == "*ESR?":
+            esr, self._esr = self._esr, 0
+            return str(esr)
+        if header == "SYST:ERR?":
+            return self.errors.pop(0) if self.errors else '+0,"No error"'
+        if header == "DATA:CAT?":
+            names = ["VOLATILE"] if self.volatile is not None else []
+            return ",".join(f'"{name}"' for name in names + list(BUILTIN_ARBS) + list(self.arbs))
+        if header == "DATA:NVOL:FREE?":
+            return f"+{self.arbSlots - len(self.arbs)}"
+        if header in ("DATA:ATTR:POIN?", "DATA:ATTR:AVER?", "DATA:ATTR:PTP?", "DATA:ATTR:CFAC?"):
+            name = argument.strip().strip('"').upper() or self.settings["FUNC:USER"]
+            points = self.volatile if name == "VOLATILE" else self.arbs.get(name)
+            if points is None:
+                self._error(-781, "Not found; arb waveform name not found")
+                return None
+            if header == "DATA:ATTR:POIN?":
+                return f"+{len(points)}"
+            if header == "DATA:ATTR:AVER?":
+                return f"{points.mean():+.13E}"
+            if header == "DATA:ATTR:PTP?":
+                return f"{points.max() - points.min():+.13E}"
+            return f"{np.abs(points).max() / np.sqrt(np.mean(points ** 2)):+.13E}"
+        if header in ("FREQ?", "VOLT?", "VOLT:OFFS?", "BURS:PHAS?"):
+            return f"{self.settings[header[:-1]]:+.13E}"
+        if header in ("BURS:STAT?", "OUTP?"):
+            return "1" if self.settings[header[:-1]] else "0"
+        if header[:-1] in self.settings:
+            return str(self.settings[header[:-1]])
+        self._error(-113, "Undefined header")
+        return None
+
+    def _number(self, argument):
+        try:
+            return float(argument)
+        except ValueError:
+            self._error(-104, "Data type error")
+            return 0.0
+
+    def _dataAscii(self, header, argument):
+        target, _, values = argument.partition(",")
+        if target.strip().upper() != "VOLATILE":
+            self._error(-113, "Undefined header")
+            return
+        points = np.array([float(value) for value in values.split(",")])
+        if header == "DATA:DAC":
+            points = points / 8191.0
+        self._storeVolatile(points)
+
+    def _storeVolatile(self, points):
+        if not 1 <= len(points) <= 65536 or np.abs(points).max() > 1:
+            self._error(-222, "Data out of range")
+            return
+        self.volatile = np.rint(np.asarray(points, dtype=float) * 8191) / 8191 # 14-bit resolution
+        if self.corruptUploads > 0 and len(self.volatile) > 1:
+            self.corruptUploads -= 1
+            self.volatile = self.volatile[:-1] # Silently lost the last point
+
+    def _copy(self, argument):
+        name, _, source = (part.strip().upper() for part in argument.partition(","))
+        if source != "VOLATILE" or self.volatile is None:
+            self._error(-785, "Volatile arb waveform memory is empty")
+        elif name not in self.arbs and len(self.arbs) >= self.arbSlots:
+            self._error(-784, "Not enough memory; delete an existing waveform")
+        else:
+            self.arbs[name] = self.volatile.copy()
+            busy = self.copyBaseSeconds + self.copySecondsPerPoint * len(self.volatile)
+            self._busyUntil = max(self._busyUntil, self.now()) + busy
+
+    def _trigger(self):
+        if not self.settings["BURS:STAT"] or self.settings["TRIG:SOUR"] != "BUS":
+            self._error(-211, "Trigger ignored")
+            return
+        now = self.now()
+        if now < self._burstEnd:
+            self.ignoredTriggers += 1
+            return
+        self.triggers.append(now)
+        self._burstEnd = now + self.settings["BURS:NCYC"] / self.settings["FREQ"]
+
+    def activeWaveform(self):
+        """Returns the normalized points of the selected arb (None for built-in waveforms)."""
+        name = self.settings["FUNC:USER"]
+        return self.volatile if name == "VOLATILE" else self.arbs.get(name)
+
+class SimulatedResourceManager:
+    """
+    Stand-in for pyvisa.ResourceManager that opens SimulatedInstruments.
+
+    Every address gets its own instrument, which keeps its state when the resource is
+    closed and opened again (like a real device).
+    """
+
+    def __init__(self, addresses=("ASRL1::INSTR",), **instrumentOptions):
+        self.instrumentOptions = instrumentOptions
+        self.instruments = {address: SimulatedInstrument(**instrumentOptions) for address in addresses}
+
+    def list_resources(self, query="?*::INSTR"):
+        return tuple(self.instruments)
+
+    def open_resource(self, address, **kwargs):
+        if address not in self.instruments:
+            self.instruments[address] = SimulatedInstrument(**self.instrumentOptions)
+        return self.instruments[address]
+
+    def close(self):
+        pass
@@ -0,0 +1,123 @@
+import csv
+import functools
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+HISTOGRAM_BOUNDS_MS = (0.1, 0.3, 1, 3, 10, 30, 100, 300, 1000, 3000) # Upper bounds of the latency histogram buckets (the last bucket is open)
+
+class Tracer:
+    """
+    Records the latency, payload size and errors of SCPI commands and pipeline stages.
+
+    Every record has a kind ("scpi", "math", "wait", "plot", ...) and a name (e.g. "write DATA:DAC").
+    Besides the single records (the last maxRecords are kept) the tracer aggregates count, time,
+    bytes, errors and a latency histogram per kind and name.
+    Tracing is off by default; while it is off the instrumented code only checks tracer.enabled.
+    """
+
+    def __init__(self, maxRecords=100000):
+        self.enabled = False
+        self.records = deque(maxlen=maxRecords)
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Removes all records and statistics."""
+        with self._lock:
+            self.records.clear()
+            self.stats.clear()
+
+    def record(self, kind, name, seconds, nbytes=0, error=None):
+        """Adds a single record and updates the statistics of its kind and name."""
+        with self._lock:
+            self.records.append({"time": time.time(), "kind": kind, "name": name, "seconds": seconds,
+                                 "bytes": nbytes, "error": None if error is None else str(error)})
+            stats = self.stats.get((kind, name))
+            if stats is None:
+                stats = self.stats[(kind, name)] = {"count": 0, "totalSeconds": 0.0, "minSeconds": seconds, "maxSeconds": seconds,
+                                                    "bytes": 0, "errors": 0, "histogram": [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)}
+            stats["count"] += 1
+            stats["totalSeconds"] += seconds
+            stats["minSeconds"] = min(stats["minSeconds"], seconds)
+            stats["maxSeconds"] = max(stats["maxSeconds"], seconds)
+            stats["bytes"] += nbytes
+            stats["errors"] += error is not None
+            bucket = 0
+            while bucket < len(HISTOGRAM_BOUNDS_MS) and seconds * 1000 > HISTOGRAM_BOUNDS_MS[bucket]:
+                bucket += 1
+            stats["histogram"][bucket] += 1
+
+    def recordCommand(self, method, message, seconds, error=None):
+        """Records a SCPI write or query. The name is the method and the command header, e.g. "query *OPC?"."""
+        if isinstance(message, (bytes, bytearray)):
+            header = bytes(message[:32]).split(b" ", 1)[0].decode("ascii", errors="replace")
+        else:
+            header = message.split(" ", 1)[0]
+        self.record("scpi", f"{method} {header.strip()}", seconds, len(message), error)
+
+    @contextmanager
+    def span(self, kind, name, nbytes=0):
+        """Records the time of the enclosed block (only if tracing is enabled)."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.record(kind, name, time.perf_counter() - start, nbytes, error)
+
+    def summary(self):
+        """Returns the aggregated statistics as a list of dicts, sorted by total time."""
+        with self._lock:
+            rows = [dict(stats, kind=kind, name=name, meanSeconds=stats["totalSeconds"] / stats["count"],
+                         histogram=list(stats["histogram"]))
+                    for (kind, name), stats in self.stats.items()]
+        return sorted(rows, key=lambda row: row["totalSeconds"], reverse=True)
+
+    def formatSummary(self):
+        """Returns the statistics as a text table."""
+        lines = [f"{'kind':<9}{'name':<28}{'count':>7}{'total [ms]':>12}{'mean [ms]':>11}{'max [ms]':>10}{'bytes':>10}{'errors':>8}"]
+        for row in self.summary():
+            lines.append(f"{row['kind']:<9}{row['name'][:27]:<28}{row['count']:>7}{row['totalSeconds'] * 1000:>12.2f}"
+                         f"{row['meanSeconds'] * 1000:>11.3f}{row['maxSeconds'] * 1000:>10.2f}{row['bytes']:>10}{row['errors']:>8}")
+        return "\n".join(lines)
+
+    def exportJson(self, path):
+        """Writes the statistics, the histogram bucket bounds and all records to a JSON file."""
+        with self._lock:
+            records = list(self.records)
+        with open(path, "w") as file:
+            json.dump({"histogramBoundsMs": HISTOGRAM_BOUNDS_MS, "summary": self.summary(), "records": records}, file, indent=2)
+
+    def exportCsv(self, path):
+        """Writes all records to a CSV file (one line per command or stage)."""
+        with self._lock:
+            records = list(self.records)
+        with open(path, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=["time", "kind", "name", "seconds", "bytes", "error"])
+            writer.writeheader()
+            writer.writerows(records)
+
+tracer = Tracer() # Global tracer used by wavefunctions and mathfunctions
+
+def traced(kind, name=None):
+    """Decorator that records the run time of a function with the global tracer (while it is enabled)."""
+    def decorator(func):
+        recordName = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with tracer.span(kind, recordName):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import numpy as np
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+STORE_VERSION = 1 # Increase when the stored profiles change, so old entries are not used anymore
+
+class WaveformStore:
+    """
+    Persistent store of computed profiles (see wavefunctions.buildProfile).
+
+    Every entry is identified by the parameters it was computed from. Arrays are saved as .npy
+    files and loaded memory-mapped (read-only, the data is only read from disk when it is used),
+    bytes (e.g. the escaped upload block) as .bin files and all other values in the index file
+    (index.json), which also remembers the size and the last use of every entry.
+    If the store gets larger than maxBytes, the least recently used entries are deleted.
+    The last use of an entry is only kept in memory and written with the next put() or close().
+    Only one program can open the store at a time (lock file); opening it a second time raises OSError.
+    """
+
+    def __init__(self, directory, maxBytes=200 * 2**20):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._dirty = False # Entries were used since the index was saved
+        os.makedirs(directory, exist_ok=True)
+        self._lockFile = self._lockDirectory()
+        self._loadIndex()
+
+    def _lockDirectory(self):
+        """Locks the store for this program. The lock ends with the program, also if it crashes."""
+        lockFile = open(os.path.join(self.directory, "lock"), "a+b")
+        try:
+            if fcntl is not None:
+                fcntl.flock(lockFile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(lockFile.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            lockFile.close()
+            raise OSError(f"The waveform store {self.directory} is used by another program.")
+        return lockFile
+
+    def close(self):
+        """Saves the last use of the entries and releases the store for other programs."""
+        with self._lock:
+            if self._lockFile is None:
+                return
+            if self._dirty:
+                self._saveIndex()
+            self._lockFile.close()
+            self._lockFile = None
+
+    def _indexPath(self):
+        return os.path.join(self.directory, "index.json")
+
+    def _loadIndex(self):
+        try:
+            with open(self._indexPath()) as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            index = {}
+        if index.get("version") == STORE_VERSION:
+            self._entries = index.get("entries", {})
+        # Remove files without an entry (e.g. evicted while they were still memory-mapped, or of an old version)
+        known = {name for entry in self._entries.values() for name in entry["files"].values()}
+        for name in os.listdir(self.directory):
+            if name not in ("index.json", "lock") and name not in known:
+                self._remove(name)
+
+    def _saveIndex(self):
+        temporary = self._indexPath() + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump({"version": STORE_VERSION, "entries": self._entries}, file)
+        os.replace(temporary, self._indexPath()) # Never leaves a half written index behind
+        self._dirty = False
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass # Still memory-mapped (Windows); removed with the next start
+
+    @staticmethod
+    def keyFor(parameters):
+        """Returns the entry name for a dict of parameters (JSON compatible values)."""
+        return hashlib.sha1(json.dumps(parameters, sort_keys=True).encode("utf-8")).hexdigest()[:20]
+
+    def totalBytes(self):
+        """Size of all stored files in bytes."""
+        with self._lock:
+            return sum(entry["bytes"] for entry in self._entries.values())
+
+    def get(self, parameters):
+        """
+        Returns the stored profile for the parameters, or None if there is none.
+        Arrays are read-only memory maps of the stored files.
+        """
+        key = self.keyFor(parameters)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            profile = dict(entry["values"])
+            try:
+                for name, fileName in entry["files"].items():
+                    path = os.path.join(self.directory, fileName)
+                    if fileName.endswith(".npy"):
+                        profile[name] = np.load(path, mmap_mode="r")
+                    else:
+                        with open(path, "rb") as file:
+                            profile[name] = file.read()
+            except (OSError, ValueError) as e:
+                print(f"Waveform store: dropping broken entry {key}: {e}")
+                self._discard(key)
+                self._saveIndex()
+                return None
+            entry["lastUsed"] = time.time()
+            self._dirty = True # Saved with the next put() or close(), a read does not write the index
+            return profile
+
+    def put(self, parameters, profile):
+        """
+        Stores a profile. Array values are saved as .npy, bytes as .bin files, all other values
+        must be JSON compatible. Afterwards old entries are evicted until the store fits into maxBytes.
+        """
+        key = self.keyFor(parameters)
+        values, files, size = {}, {}, 0
+        with self._lock:
+            self._discard(key)
+            for name, value in profile.items():
+                if isinstance(value, np.ndarray):
+                    fileName = f"{key}_{name}.npy"
+                    np.save(os.path.join(self.directory, fileName), value)
+                elif isinstance(value, (bytes, bytearray)):
+                    fileName = f"{key}_{name}.bin"
+                    with open(os.path.join(self.directory, fileName), "wb") as file:
+                        file.write(value)
+                else:
+                    values[name] = value.item() if isinstance(value, np.generic) else value
+                    continue
+                files[name] = fileName
+                size += os.path.getsize(os.path.join(self.directory, fileName))
+            self._entries[key] = {"parameters": parameters, "values": values, "files": files,
+                                  "bytes": size, "lastUsed": time.time()}
+            self._evict(keep=key)
+            self._saveIndex()
+
+    def clear(self):
+        """Deletes all entries."""
+        with self._lock:
+            for key in list(self._entries):
+                self._discard(key)
+            self._saveIndex()
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            for fileName in entry["files"].values():
+                self._remove(fileName)
+
+    def _evict(self, keep):
+        total = sum(entry["bytes"] for entry in self._entries.values())
+        for key in sorted(self._entries, key=lambda key: self._entries[key]["lastUsed"]):
+            if total <= self.maxBytes:
+                break
+            if key != keep:
+                total -= self._entries[key]["bytes"]
+                self._discard(key)
@@ -2,14 +2,510 @@ import mathfunctions as mf
 import pyvisa
 import time
 import numpy as np
+import threading
+import hashlib
+import json
+import os
+import atexit
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
+from collections import OrderedDict
+from contextlib import contextmanager
+from tracing import tracer, traced
+from waveformstore import WaveformStore
 
 # Global load time (in seconds) for waiting after sending the pulse.
-rm = pyvisa.ResourceManager() # Global variable for the pyvisa resource manager
-defaultProfile = "ROUVEN" # Default profile to store the custom waveform. We are only using one profile and overwrite it each time.
-loadTimeSeconds = 6 # Time to wait after loading a profile
-numberScaleFactor = 200 # Factor to scale the number of points in the waveform. 
+defaultProfile = "ROUVEN" # Default profile to store custom waveforms that are not uploaded through the waveform cache. It is overwritten each time.
+loadTimeSeconds = 6 # Maximum time to wait for the device to finish loading a profile
+numberScaleFactor = None # Fixed number of points per millisecond. None chooses the smallest number of points that keeps all edges exact.
+minimumPoints = 8 # Lower limit for the number of points of an automatically sized waveform
+curvePoints = 1000 # Lower limit for the number of points of an automatically sized waveform with ramps or curves
+maxTimeStepMs = None # Longest automatic time step, None for no limit. The leading 0 V point lasts one step, so the pulse starts one step after *TRG
+                     # (profile["triggerDelay"], e.g. 1 ms for 3/7/1 ms). 0.005 limits the delay to 5 us like the old fixed factor of 200, with as many points.
+maxPoints = 65536 # Largest arb the 33220A can store. Longer waveforms get a coarser step, which rounds their edges.
+completionTimeoutSeconds = 3 # Maximum time to wait for the device to apply settings
+triggerTimeSeconds = 1 # Maximum time to wait for the device to process a trigger
+adapterReadTimeoutMs = 3000 # Longest time the Prologix adapter waits for an answer (++read_tmo_ms). Longer waits read again until their deadline.
 usbPort = 6  # USB Port where the device is connected. Check in device manager. This value will be overwritten in the GUI.
-pyvisaAdress = f"ASRL{usbPort}::INSTR" # global variable for the pyvisa adress of the connected device
+arbSlotCount = 4 # Number of non-volatile arb slots of the 33220A used for the waveform cache
+resetPoints = 64 # Points of the reset arb. Its first point is the 0 V idle value, so the reset level starts one point after the trigger.
+triggerSpinSeconds = 0.002 # The trigger scheduler busy-waits for the last part of every interval instead of sleeping
+settingsFile = os.path.join(os.path.expanduser("~"), ".wavegenerator.json") # Remembers the address of the discovered device for the next launch
+bigEndianTransfer = False # Byte order of binary DAC uploads. False sends little endian data (FORM:BORD SWAP), which is the native order of the PC.
+storeDirectory = os.path.join(os.path.expanduser("~"), ".wavegenerator_store") # Computed profiles are kept here, see WaveformStore
+storeMaxBytes = 200 * 2**20 # Largest size of the waveform store. The least recently used profiles are deleted first.
+useWaveformStore = True # If False, every profile is computed again
+storeMinComputeSeconds = 0.001 # Only profiles that take longer to compute are stored. Loading a stored profile takes a few 100 us.
+batchMaxLength = 4000 # Longest message of a command batch in characters. Longer single commands (e.g. ASCII waveforms) are sent alone.
+verifyUploads = True # Check every upload with the waveform attributes the device reports (DATA:ATTR) before it is stored
+uploadRetries = 2 # Number of times a failed upload is sent again before giving up
+
+class InstrumentError(Exception):
+    """Raised when the device reports errors (SYST:ERR?) for a command batch. errors is the list of error strings."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("Device error: " + "; ".join(errors))
+
+class UploadVerificationError(Exception):
+    """Raised when an uploaded waveform does not match the data that was sent (see verifyArb). problems lists the differences."""
+
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__("Upload verification failed: " + "; ".join(problems))
+
+def isTimeout(error):
+    """Returns True if the exception is a VISA timeout."""
+    return isinstance(error, pyvisa.errors.VisaIOError) and error.error_code == pyvisa.constants.StatusCode.error_timeout
+
+class InstrumentSession:
+    """
+    Long-lived connection to the generator.
+
+    The pyvisa resource is opened on first use and kept open for all following commands.
+    If a command fails with a VISA error, the connection is dropped and reopened by the next command;
+    the known device state is forgotten then, because the device may have been restarted in between.
+    All commands are serialized by a reentrant lock; use the session as a context manager
+    ("with session:") to keep a sequence of commands together, or batch() to also send them
+    as one message.
+    The session also keeps the device state the other functions rely on: the arb slot cache,
+    the selected arb (activeProfile), the duration of one burst (burstDurationSeconds) and a shadow
+    of the last value sent for each setting (shadowSettings, see applySettings).
+    """
+
+    def __init__(self, address=None, timeoutMs=5000, resourceManager=None):
+        self.address = address
+        self.timeoutMs = timeoutMs
+        self._resourceManager = resourceManager # Created on first use if None
+        self._resource = None
+        self._lock = threading.RLock()
+        self.arbCache = ArbSlotCache() # Waveforms stored on the device
+        self.activeProfile = defaultProfile # Name of the arb that is currently selected with FUNC:USER
+        self.burstDurationSeconds = 0 # Duration of one triggered burst, set by prepareTrigger. Triggers during a burst are ignored by the device.
+        self.pendingRestore = None # Settings of the pulse profile to select again once the reset burst is over (see sendReset)
+        self.resetDeadline = 0.0 # End of the running reset burst (time.perf_counter)
+        self.shadowSettings = {} # SCPI header -> last value sent to the device. Settings that are not in here are unknown.
+        self.pendingWrites = False # True if commands were sent since the device last confirmed completion (*OPC?)
+        self._batch = None # Commands collected by batch(), None outside of a batch
+        self._batchTimeoutSeconds = completionTimeoutSeconds
+
+    def __enter__(self):
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self._lock.release()
+
+    def setAddress(self, address):
+        """Changes the pyvisa address. The new device is connected on the next command."""
+        with self._lock:
+            if address != self.address:
+                self.close()
+                self.address = address
+                self.invalidateState()
+
+    def setResourceManager(self, resourceManager):
+        """Replaces the pyvisa resource manager (e.g. with a SimulatedResourceManager)."""
+        with self._lock:
+            self.close()
+            self._resourceManager = resourceManager
+            self.invalidateState()
+
+    def invalidateState(self):
+        """Forgets everything known about the device (arb slots and settings), e.g. after it was used from the front panel."""
+        with self._lock:
+            self.arbCache.invalidate()
+            self.arbCache.pinned.clear()
+            self.shadowSettings.clear()
+            self.pendingWrites = True
+            self.pendingRestore = None # The settings to restore may not be on the device anymore
+
+    def resourceManager(self):
+        """Returns the pyvisa resource manager of the session (created on first use)."""
+        with self._lock:
+            if self._resourceManager is None:
+                self._resourceManager = pyvisa.ResourceManager()
+            return self._resourceManager
+
+    def open(self):
+        """Returns the open pyvisa resource and connects first if needed."""
+        with self._lock:
+            if self._resource is None:
+                if self.address is None:
+                    raise RuntimeError("No instrument address set.")
+                self._resource = self.resourceManager().open_resource(self.address)
+                self._resource.timeout = self.timeoutMs
+            return self._resource
+
+    def close(self):
+        """Closes the connection. It is reopened automatically by the next command, which starts without any known device state."""
+        with self._lock:
+            if self._resource is not None:
+                try:
+                    self._resource.close()
+                except pyvisa.errors.Error:
+                    pass # The connection is dropped anyway
+                self._resource = None
+                self.invalidateState()
+
+    def _call(self, method, *args, keepOnTimeout=False):
+        with self._lock:
+            start = time.perf_counter() if tracer.enabled else None
+            error = None
+            try:
+                return getattr(self.open(), method)(*args)
+            except Exception as e:
+                error = e
+                if isinstance(e, pyvisa.errors.Error) and not (keepOnTimeout and isTimeout(e)):
+                    self.close() # Reconnect with the next command
+                raise
+            finally:
+                if start is not None:
+                    tracer.recordCommand(method, args[0] if args else "", time.perf_counter() - start, error)
+
+    def write(self, command):
+        """Sends a single SCPI command. Inside batch() the command is collected and sent with the batch."""
+        with self._lock:
+            self.pendingWrites = True
+            if self._batch is not None:
+                self._batch.append(command)
+                return
+            self._call("write", command)
+
+    def write_raw(self, data):
+        """Sends raw bytes (e.g. binary blocks) without adding a termination."""
+        with self._lock:
+            self.flush()
+            self.pendingWrites = True
+            self._call("write_raw", data)
+
+    @contextmanager
+    def batch(self, timeoutSeconds=None):
+        """
+        Collects the commands written inside the block and sends them joined with ";:" (";" before
+        common commands like *TRG) as one
+        message (or a few, see batchMaxLength). SYST:ERR? is appended to every message, so each
+        message costs a single round trip and is checked for errors. Because the device answers
+        only after it has executed the commands, a successful batch also confirms completion.
+        Queries and binary writes inside the block send the collected commands first.
+        Nested batches are part of the outermost one. The session stays locked for the whole block.
+
+        Parameters:
+          timeoutSeconds (float, optional): Maximum time for the device to execute a message and answer
+                                            the error check. Defaults to completionTimeoutSeconds.
+
+        Raises:
+          InstrumentError: If the device reports an error.
+          TimeoutError: If the device did not answer within timeoutSeconds.
+        """
+        with self._lock:
+            if self._batch is not None:
+                yield self
+                return
+            self._batch = []
+            self._batchTimeoutSeconds = timeoutSeconds or completionTimeoutSeconds
+            try:
+                yield self
+                self.flush()
+            except BaseException:
+                if self._batch:
+                    self.shadowSettings.clear() # Collected settings were never sent
+                raise
+            finally:
+                self._batch = None
+
+    def flush(self):
+        """Sends the commands collected by batch() (if any) and checks them with SYST:ERR?."""
+        with self._lock:
+            if not self._batch:
+                return
+            commands, self._batch = self._batch, []
+            messages = [commands[0]]
+            for command in commands[1:]:
+                if len(messages[-1]) + len(command) + 2 > batchMaxLength:
+                    messages.append(command)
+                else:
+                    messages[-1] += (";" if command.startswith("*") else ";:") + command # Common commands (*TRG) take no leading colon
+            try:
+                for message in messages:
+                    try:
+                        answer = self._query(message + ";:SYST:ERR?", int(self._batchTimeoutSeconds * 1000))
+                    except pyvisa.errors.VisaIOError as e:
+                        if isTimeout(e):
+                            raise TimeoutError(f"Device did not finish within {self._batchTimeoutSeconds} s.") from e
+                        raise
+                    self._raiseErrors(answer)
+            except Exception:
+                self.shadowSettings.clear() # Unknown which of the settings were applied
+                raise
+            self.pendingWrites = False
+
+    def checkErrors(self):
+        """Reads the error queue of the device (SYST:ERR?). Raises InstrumentError if it holds errors."""
+        with self._lock:
+            self.flush()
+            self._raiseErrors(self._query("SYST:ERR?"))
+
+    def _raiseErrors(self, answer):
+        """Reads the rest of the error queue after the SYST:ERR? answer and raises InstrumentError if there were errors."""
+        errors = []
+        while not answer.strip().startswith(("+0,", "0,")) and len(errors) < 20: # The device queues up to 20 errors
+            errors.append(answer.strip())
+            answer = self._query("SYST:ERR?")
+        if errors:
+            raise InstrumentError(errors)
+
+    def applySettings(self, settings):
+        """
+        Sends the settings whose value differs from the last value sent (see shadowSettings).
+
+        Parameters:
+          settings (dict): SCPI header -> value. Changed settings are sent in the given order as "<header> <value>".
+
+        Returns:
+          list: The headers that were sent.
+        """
+        with self._lock:
+            changed = [header for header, value in settings.items() if self.shadowSettings.get(header) != str(value)]
+            for header in changed:
+                value = str(settings[header])
+                self.shadowSettings.pop(header, None) # Unknown if the write fails
+                self.write(f"{header} {value}")
+                self.shadowSettings[header] = value
+            return changed
+
+    def forgetSettings(self, *headers):
+        """Marks the given settings as unknown, so applySettings sends them again."""
+        with self._lock:
+            for header in headers:
+                self.shadowSettings.pop(header, None)
+
+    def query(self, command, timeoutMs=None):
+        """Sends a SCPI query and returns the answer. timeoutMs overrides the read timeout for this query only."""
+        with self._lock:
+            self.flush()
+            return self._query(command, timeoutMs)
+
+    def _query(self, command, timeoutMs=None):
+        with self._lock:
+            if timeoutMs is None:
+                return self._call("query", command)
+            resource = self.open()
+            previousTimeout = resource.timeout
+            resource.timeout = min(timeoutMs, adapterReadTimeoutMs)
+            try:
+                if timeoutMs <= adapterReadTimeoutMs:
+                    return self._call("query", command)
+                return self._pollAnswer(command, time.perf_counter() + timeoutMs / 1000)
+            finally:
+                if self._resource is resource:
+                    resource.timeout = previousTimeout
+
+    def _pollAnswer(self, command, deadline):
+        """
+        Sends a query whose answer may take longer than the adapter waits for it (adapterReadTimeoutMs).
+        A read that times out is repeated after "++read eoi" until the deadline (time.perf_counter),
+        so the device can take as long as it needs and the answer is still read in order.
+        """
+        self._call("write", command)
+        while True:
+            self.open().timeout = max(1, int(min(adapterReadTimeoutMs, (deadline - time.perf_counter()) * 1000))) # Never read past the deadline
+            try:
+                return self._call("read", keepOnTimeout=True)
+            except pyvisa.errors.VisaIOError as e:
+                if not isTimeout(e):
+                    raise
+                if time.perf_counter() >= deadline:
+                    self.close() # The answer may still come; do not read it as the answer of the next query
+                    raise
+            self._call("write", "++read eoi") # The adapter gave up reading, let it read again
+
+class ArbSlotCache:
+    """
+    Remembers which waveforms are stored in the non-volatile arb slots of the device.
+
+    Waveforms are identified by a hash of their DAC codes and stored under a name derived from
+    that hash, so a waveform that is already on the device only has to be selected with FUNC:USER.
+    When all slots are in use, the least recently used cached waveform is deleted.
+    Only arbs with the cache prefix are ever deleted; other user arbs (e.g. defaultProfile) are left alone,
+    and so are the arbs in pinned (the pulse profile while a reset burst is running, see sendReset).
+    """
+
+    builtinArbs = ("VOLATILE", "EXP_RISE", "EXP_FALL", "NEG_RAMP", "SINC", "CARDIAC")
+
+    def __init__(self, slots=arbSlotCount, prefix="WG"):
+        self.slots = slots
+        self.prefix = prefix
+        self._names = OrderedDict() # arb name -> None, ordered from least to most recently used
+        self._foreignSlots = 0 # Slots used by user arbs which are not managed by the cache
+        self._synced = False
+        self.pinned = set() # Names that must not be evicted
+
+    def nameFor(self, dacCodes):
+        """Returns the arb name for the given DAC codes (max. 12 characters, starting with a letter)."""
+        digest = hashlib.sha1(np.ascontiguousarray(dacCodes, dtype=np.int16).tobytes()).hexdigest()
+        return (self.prefix + digest).upper()[:12]
+
+    def invalidate(self):
+        """Forgets the known device state. The catalog is queried again on the next use."""
+        self._names.clear()
+        self._foreignSlots = 0
+        self._synced = False
+
+    def sync(self, smu):
+        """Reads the arb catalog (DATA:CAT?) and the selected arb (FUNC:USER?) of the device and updates the known slots."""
+        catalog = [name.strip().strip('"') for name in smu.query("DATA:CAT?").split(",")]
+        userArbs = [name for name in catalog if name and name not in self.builtinArbs]
+        cached = [name for name in userArbs if name.startswith(self.prefix)]
+        # Arbs of a previous session are unknown to us, so they are the first ones to be evicted
+        for name in cached:
+            if name not in self._names:
+                self._names[name] = None
+                self._names.move_to_end(name, last=False)
+        for name in list(self._names):
+            if name not in cached:
+                del self._names[name]
+        self._foreignSlots = len(userArbs) - len(cached)
+        self._synced = True
+        # The selected arb cannot be deleted; after a restart it may be one of the arbs of the previous session
+        smu.activeProfile = smu.query("FUNC:USER?").strip().strip('"').upper()
+
+    def lookup(self, smu, name):
+        """Returns True if the arb is stored on the device and marks it as most recently used."""
+        if not self._synced:
+            self.sync(smu)
+        if name in self._names:
+            self._names.move_to_end(name)
+            return True
+        return False
+
+    def reserve(self, smu, name):
+        """Makes room for a new arb (deleting the least recently used ones if needed) and registers it.
+        Returns False if no slot can be freed (all are used by other user arbs or pinned)."""
+        if not self._synced:
+            self.sync(smu)
+        while len(self._names) + self._foreignSlots >= self.slots:
+            evicted = next((cached for cached in self._names if cached not in self.pinned), None)
+            if evicted is None:
+                return False # Nothing may be deleted
+            del self._names[evicted]
+            if evicted == smu.activeProfile:
+                smu.applySettings({"FUNC:USER": "VOLATILE"}) # The selected arb cannot be deleted
+                smu.activeProfile = "VOLATILE"
+            smu.write(f"DATA:DEL {evicted}")
+        self._names[name] = None
+        return True
+
+session = InstrumentSession(f"ASRL{usbPort}::INSTR") # Global session for the connected device. Use setUsbPort to change the port.
+
+def setInstrumentAddress(address):
+    """Sets the pyvisa address of the device. The session connects to it with the next command."""
+    session.setAddress(address)
+
+def setUsbPort(port):
+    """Sets the USB (COM) port of the device. The session connects to it with the next command."""
+    global usbPort
+    usbPort = int(port)
+    setInstrumentAddress(f"ASRL{usbPort}::INSTR")
+
+def probeInstrument(resourceManager, address, timeoutMs=500):
+    """
+    Checks whether a 33220A behind a Prologix adapter answers at the given address.
+    Asks the adapter for its version (++ver) first, so ports with other devices fail fast.
+
+    Returns:
+      str or None: The *IDN? answer of the generator, or None if it is not there.
+    """
+    try:
+        resource = resourceManager.open_resource(address, open_timeout=timeoutMs)
+    except (pyvisa.errors.Error, OSError, ValueError):
+        return None
+    try:
+        resource.timeout = timeoutMs
+        if "prologix" not in resource.query("++ver").lower():
+            return None
+        idn = resource.query("*IDN?").strip()
+        return idn if "33220A" in idn else None
+    except (pyvisa.errors.Error, OSError, ValueError, UnicodeDecodeError):
+        return None
+    finally:
+        try:
+            resource.close()
+        except (pyvisa.errors.Error, OSError):
+            pass
+
+def loadSettings():
+    """Returns the remembered settings (empty if there are none)."""
+    try:
+        with open(settingsFile) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def saveSettings(**settings):
+    """Updates the remembered settings."""
+    stored = loadSettings()
+    stored.update(settings)
+    try:
+        with open(settingsFile, "w") as file:
+            json.dump(stored, file, indent=2)
+    except OSError as e:
+        print(f"Could not save the settings: {e}")
+
+def discoverInstrument(timeoutSeconds=3, probeTimeoutMs=500):
+    """
+    Searches the serial ports for the generator and sets the session address to it.
+
+    The remembered address of the last launch is tried first. Otherwise all ASRL resources are
+    probed concurrently (see probeInstrument); the search ends after at most timeoutSeconds.
+    A found address is remembered for the next launch.
+
+    Returns:
+      tuple or None: (address, idn) of the generator, or None if no generator answered.
+    """
+    resourceManager = session.resourceManager()
+    remembered = loadSettings().get("address")
+    if remembered:
+        idn = probeInstrument(resourceManager, remembered, probeTimeoutMs)
+        if idn:
+            setInstrumentAddress(remembered)
+            return remembered, idn
+
+    try:
+        addresses = [address for address in resourceManager.list_resources("ASRL?*::INSTR") if address != remembered]
+    except pyvisa.errors.Error:
+        return None
+    if not addresses:
+        return None
+
+    pool = ThreadPoolExecutor(max_workers=len(addresses))
+    futures = {pool.submit(probeInstrument, resourceManager, address, probeTimeoutMs): address for address in addresses}
+    found = None
+    try:
+        for future in as_completed(futures, timeout=timeoutSeconds):
+            if future.result():
+                found = futures[future], future.result()
+                break
+    except FutureTimeoutError:
+        pass
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True) # Do not wait for ports that are still hanging
+
+    if found:
+        setInstrumentAddress(found[0])
+        saveSettings(address=found[0])
+    return found
+
+def useSimulatedInstrument(**options):
+    """
+    Connects the global session to a simulated 33220A instead of the real device.
+    The options are passed to SimulatedInstrument (e.g. realtime=False). Returns the simulated instrument.
+    """
+    from siminstrument import SimulatedResourceManager
+    address = "ASRL::SIM::INSTR"
+    resourceManager = SimulatedResourceManager((address,), **options)
+    session.setResourceManager(resourceManager)
+    session.setAddress(address)
+    return resourceManager.open_resource(address)
 
 def safe_float(value_str, field_name="Value"):
     """
@@ -21,9 +517,16 @@ def safe_float(value_str, field_name="Value"):
     except ValueError:
         raise ValueError(f"{field_name} must be a number.")
 
+plotArtists = {} # Reused artists of updatePlot for every axes
+
+@traced("plot")
 def updatePlot(ax, canvas, pulse, pulseWidth, type="DEF"):
     """
     Updates the embedded plot showing the loaded pulse.
+
+    The artists are created on the first call and only get new data afterwards.
+    Step pulses ("SQU") are drawn with one stair per run of equal values, other pulses
+    with the min/max of every pixel column, so the drawing cost does not grow with the point count.
     
     Parameters:
       ax (matplotlib.axes.Axes): The axes to update.
@@ -31,33 +534,247 @@ def updatePlot(ax, canvas, pulse, pulseWidth, type="DEF"):
       pulse (list or array of floats): The pulse amplitude values.
       pulseWidth (float): The pulse width in milliseconds.
     """
-    ax.clear()
+    artists = plotArtists.get(ax)
+    if artists is None:
+        artists = plotArtists[ax] = {"type": None, "SQU": None, "DEF": None,
+                                     "text": ax.text(0.5, 0.5, "No pulse available", horizontalalignment='center',
+                                                     verticalalignment='center', transform=ax.transAxes, visible=False)}
+        ax.set_title("Loaded Pulse")
+
+    plotType = "SQU" if type == "SQU" else "DEF"
     if pulse is not None:
-        # Create a time axis assuming the pulse spans the entire pulseWidth.
+        pulse = np.asarray(pulse, dtype=float)
         N = len(pulse)
-        time_axis = np.linspace(0, pulseWidth, N)
-        if type == "SQU":
-            if len(time_axis) == len(pulse):
-                time_axis = np.append(time_axis, time_axis[-1] + (time_axis[-1] - time_axis[-2]))
-
-            ax.stairs(pulse, time_axis, label="Pulse", linewidth=2)  # Reihenfolge beachten: `values, edges`
-            ax.set_xlabel("Time [ms]")
-            ax.set_ylabel("Amplitude [V]")
-            ax.set_title("Loaded Pulse")
-            ax.legend()
-            ax.grid(True)
-
+        if plotType == "SQU":
+            # One step per point over the entire pulseWidth, merged into one stair per constant run.
+            values, edges = mf.runLengthSteps(pulse, np.linspace(0, pulseWidth, N + 1))
+            if artists["SQU"] is None:
+                artists["SQU"] = ax.stairs(values, edges, label="Pulse", linewidth=2)  # Reihenfolge beachten: `values, edges`
+            else:
+                artists["SQU"].set_data(values, edges)
         else:
-            ax.plot(time_axis, pulse, label="Pulse")
-            ax.set_xlabel("Time (ms)")
-            ax.set_ylabel("Amplitude (V)")
-            ax.set_title("Loaded Pulse")
-            ax.legend()
+            # Create a time axis assuming the pulse spans the entire pulseWidth.
+            time_axis, values = mf.minMaxDecimate(np.linspace(0, pulseWidth, N), pulse, ax.bbox.width)
+            if artists["DEF"] is None:
+                artists["DEF"], = ax.plot(time_axis, values, label="Pulse")
+            else:
+                artists["DEF"].set_data(time_axis, values)
+
+        # Labels, legend and grid only change with the plot type
+        if artists["type"] != plotType:
+            if plotType == "SQU":
+                ax.set_xlabel("Time [ms]")
+                ax.set_ylabel("Amplitude [V]")
+            else:
+                ax.set_xlabel("Time (ms)")
+                ax.set_ylabel("Amplitude (V)")
+            ax.legend(handles=[artists[plotType]])
+            ax.grid(plotType == "SQU")
+            artists["type"] = plotType
+
+        margin = 0.05 * (pulse.max() - pulse.min()) or 0.5
+        ax.set_xlim(0, pulseWidth)
+        ax.set_ylim(pulse.min() - margin, pulse.max() + margin)
+
+    for key in ("SQU", "DEF"):
+        if artists[key] is not None:
+            artists[key].set_visible(pulse is not None and key == plotType)
+    artists["text"].set_visible(pulse is None)
+    if ax.get_legend() is not None:
+        ax.get_legend().set_visible(pulse is not None)
+    canvas.draw_idle()
+
+def trianglePulse(spike_amplitude, ref_amplitude, spike_time, ref_time):
+    """Spike and reference as triangles: linear up to the amplitude and back to 0 in the same time."""
+    return (("ramp", spike_time / 2, 0, spike_amplitude), ("ramp", spike_time / 2, spike_amplitude, 0),
+            ("ramp", ref_time / 2, 0, -ref_amplitude), ("ramp", ref_time / 2, -ref_amplitude, 0))
+
+def exponentialPulse(spike_amplitude, ref_amplitude, spike_time, ref_time):
+    """Spike and reference jump to their amplitude and decay exponentially (time constant: a fifth of their duration)."""
+    return (("exp", spike_time, spike_amplitude, 0, spike_time / 5), ("exp", ref_time, -ref_amplitude, 0, ref_time / 5))
+
+# Pulse families besides "Square": signal type -> function returning the piecewise description (see mf.compilePiecewise)
+# of spike and reference in Volts and milliseconds. A new family only needs a function here.
+pulseFamilies = {"Triangle": trianglePulse, "Exponential": exponentialPulse}
+
+waveformStore = None # Opened on first use, see getWaveformStore
+
+def getWaveformStore():
+    """Returns the waveform store in storeDirectory (opened on first use, closed when the program ends).
+    Raises OSError if it cannot be opened, e.g. because another program uses it."""
+    global waveformStore
+    if waveformStore is None:
+        waveformStore = WaveformStore(storeDirectory, storeMaxBytes)
+        atexit.register(waveformStore.close)
+    return waveformStore
+
+@traced("profile")
+def buildProfile(signal_type, spike_amplitude, ref_amplitude, spike_time, ref_time, delta_t, singlePulse):
+    """
+    Returns the profile for the given parameters (see computeProfile).
+    Profiles computed before are loaded from the waveform store (memory-mapped, read-only arrays)
+    instead of being computed again. The key includes the settings of getTimeStep and the byte order.
+    Only profiles that took longer than storeMinComputeSeconds to compute are stored.
+    """
+    global useWaveformStore
+    if not useWaveformStore:
+        return computeProfile(signal_type, spike_amplitude, ref_amplitude, spike_time, ref_time, delta_t, singlePulse)
+    parameters = {"signal_type": signal_type, "spike_amplitude": float(spike_amplitude), "ref_amplitude": float(ref_amplitude),
+                  "spike_time": float(spike_time), "ref_time": float(ref_time), "delta_t": float(delta_t),
+                  "singlePulse": bool(singlePulse), "numberScaleFactor": numberScaleFactor,
+                  "minimumPoints": minimumPoints, "curvePoints": curvePoints, "maxTimeStepMs": maxTimeStepMs,
+                  "maxPoints": maxPoints, "bigEndian": bigEndianTransfer}
+    try:
+        store = getWaveformStore()
+        profile = store.get(parameters)
+    except OSError as e:
+        print(f"Waveform store not available: {e}")
+        useWaveformStore = False # Do not try again in this session
+        return computeProfile(signal_type, spike_amplitude, ref_amplitude, spike_time, ref_time, delta_t, singlePulse)
+    if profile is None:
+        start = time.perf_counter()
+        profile = computeProfile(signal_type, spike_amplitude, ref_amplitude, spike_time, ref_time, delta_t, singlePulse)
+        if profile is not None and time.perf_counter() - start > storeMinComputeSeconds: # Cheap profiles are faster computed than loaded
+            try:
+                store.put(parameters, profile)
+            except OSError as e:
+                print(f"Could not store the profile: {e}")
+    return profile
+
+def getTimeStep(*durations, minPoints=minimumPoints):
+    """
+    Returns the duration of one arb point in milliseconds for a waveform made of the given durations.
+    Uses numberScaleFactor if it is set, otherwise the longest step (at most maxTimeStepMs) that places
+    every edge exactly (see mf.getMinimalTimeStep). If the waveform would not fit into maxPoints
+    (including the leading 0 V point), the step is made as fine as possible and the edges are rounded to it.
+    """
+    if numberScaleFactor:
+        timeStep = 1 / numberScaleFactor
     else:
-        ax.text(0.5, 0.5, "No pulse available", horizontalalignment='center',
-                verticalalignment='center', transform=ax.transAxes)
-        ax.set_title("Loaded Pulse")
-    canvas.draw()
+        timeStep = mf.getMinimalTimeStep(*durations, minPoints=minPoints, maxStep=maxTimeStepMs)
+    totalTime = sum(abs(duration) for duration in durations)
+    shortestStep = totalTime / (maxPoints - 1 - len(durations)) # Every duration may round up by one point
+    if timeStep < shortestStep:
+        print(f"Warning: {int(totalTime / timeStep) + 1} points do not fit into the device, using a step of "
+              f"{shortestStep * 1000:.3f} us instead of {timeStep * 1000:.3f} us. Edges are rounded to it.")
+        timeStep = shortestStep
+    return timeStep
+
+@traced("math")
+def computeProfile(signal_type, spike_amplitude, ref_amplitude, spike_time, ref_time, delta_t, singlePulse):
+    """
+    Computes the waveform of a profile without talking to the device.
+
+    Parameters:
+      signal_type (str): The type of signal ("Square" or one of pulseFamilies).
+      spike_amplitude (float): Amplitude in Volts.
+      ref_amplitude (float): Reference amplitude in Volts.
+      spike_time (float): Peaktime in milliseconds.
+      ref_time (float): Reference time in milliseconds.
+      delta_t (float): Delta time in milliseconds.
+      singlePulse (bool): If True, the returning (shifted) pulse is not subtracted.
+
+    Returns:
+      dict or None: The profile with the keys
+        - "pulse" (np.ndarray): The pulse in Volts (for plotting).
+        - "duration" (float): Duration of the pulse in milliseconds.
+        - "plotType" (str): Plot type for updatePlot.
+        - "dacCodes" (np.ndarray): The arb data for the device.
+        - "upload" (bytes): The ready-to-send DATA:DAC message with the dacCodes (see createDacUpload).
+        - "bigEndian" (bool): Byte order of the upload.
+        - "frequency" (float): Burst frequency in Hz.
+        - "amplitude" (float): Peak-to-peak amplitude in Volts.
+        - "offset" (float): DC offset in Volts.
+        - "triggerDelay" (float): Time from *TRG to the start of the pulse in milliseconds (the leading 0 V point, one time step).
+      None is returned for unknown signal types.
+    """
+    if signal_type == "Square":
+        # Duration of one point. Every segment (and the delta shift) is a whole number of points, so all edges are exact.
+        timeStep = getTimeStep(spike_time, ref_time, 0 if singlePulse else delta_t, minPoints=minimumPoints)
+        spikePoints = int(round(spike_time / timeStep))
+        refPoints = int(round(ref_time / timeStep))
+
+        # The square pulse (or the difference with its shifted copy) is a step function. It is built from its few
+        # segments straight into the arrays, see mf.createSquareArb (same result as generateSQUSQU + getPulseDifference).
+        deltaPoints = None if singlePulse else int(round(delta_t / timeStep))
+        segments, length = mf.getSquareSegments(float(spike_amplitude), float(ref_amplitude), spikePoints, refPoints, deltaPoints)
+        pulseDiff = mf.fillSegments(segments, length, dtype=np.float32) # Only used for plotting
+        # The leading 0 V point is important to tell the device to start with 0V. This is the idle DC value in burst mode.
+        # The device will always return to this value after the pulse. It lasts one time step like every other point,
+        # so the pulse starts one step (at most maxTimeStepMs) after the trigger.
+        dacCodes, amplitdueVpp, offset = mf.createSquareArb(float(spike_amplitude), float(ref_amplitude), spikePoints, refPoints,
+                                                            deltaPoints, leadingZero=True)
+
+        return {
+            "pulse": pulseDiff,
+            "duration": len(pulseDiff) * timeStep,
+            "triggerDelay": timeStep,
+            "plotType": "SQU",
+            "dacCodes": dacCodes,
+            "upload": createDacUpload(dacCodes),
+            "bigEndian": bigEndianTransfer,
+            "frequency": 10**3 / (len(dacCodes) * timeStep),
+            "amplitude": amplitdueVpp,
+            "offset": offset,
+        }
+
+    if signal_type in pulseFamilies:
+        # The description is compiled once per time step (memoized) and the same samples are used for the plot and the device.
+        description = pulseFamilies[signal_type](float(spike_amplitude), float(ref_amplitude), float(spike_time), float(ref_time))
+        timeStep = getTimeStep(*(segment[1] for segment in description), 0 if singlePulse else delta_t, minPoints=curvePoints)
+        compiled = mf.compilePiecewise(description, timeStep)
+        samples = compiled.sample(None if singlePulse else int(round(delta_t / timeStep)), leadingZero=True, dtype=np.float32)
+        dacCodes, amplitdueVpp, offset = mf.createArbDac(samples) # Leading 0 V point like for "Square"
+
+        return {
+            "pulse": samples[1:],
+            "duration": (len(samples) - 1) * timeStep,
+            "triggerDelay": timeStep,
+            "plotType": "DEF",
+            "dacCodes": dacCodes,
+            "upload": createDacUpload(dacCodes),
+            "bigEndian": bigEndianTransfer,
+            "frequency": 10**3 / (len(dacCodes) * timeStep),
+            "amplitude": amplitdueVpp,
+            "offset": offset,
+        }
+
+    print("Unknown type!")
+    return None
+
+@traced("profile")
+def applyProfile(profile, burst, progress=None, instrument=None):
+    """
+    Loads a profile from buildProfile onto the device.
+
+    Parameters:
+      profile (dict): The profile to load.
+      burst (bool): Whether burst mode is enabled.
+      progress (callable, optional): Called with a status message before each step.
+      instrument (InstrumentSession, optional): The device to use. Defaults to the global session.
+    """
+    global triggerActive
+    progress = progress or print
+    try:
+        finishReset(instrument=instrument) # Do not cut a running reset short
+    except (InstrumentError, TimeoutError) as e:
+        print(f"Could not select the pulse profile after the reset: {e}") # The new profile is selected anyway
+
+    # Send the pulse to the device (unless it is still stored in one of the arb slots) and wait for it to load.
+    # If the same waveform is selected already (e.g. only the amplitude changed), nothing is sent and the wait returns at once.
+    progress("Loading the waveform")
+    upload = profile.get("upload") if profile.get("bigEndian") == bigEndianTransfer else None # Ready-to-send data, if it has the current byte order
+    uploaded = loadCachedDac(profile["dacCodes"], instrument=instrument, upload=upload)
+    waitForCompletion(loadTimeSeconds if uploaded else completionTimeoutSeconds, instrument=instrument)
+
+    # If burst mode is enabled, prepare the trigger. Important: Without burst mode the trigger won't work and the profiles may not be applied correctly.
+    if burst:
+        progress("Preparing the trigger mode")
+        prepareTrigger(profile["frequency"], amplitude=profile["amplitude"]/2, offset=profile["offset"]/2, instrument=instrument)
+        waitForCompletion(instrument=instrument)
+        triggerActive = True
+
+    progress("Profile has been loaded.")
 
 def loadProfile(signal_type, spike_amplitude, ref_amplitude, spike_time, ref_time, delta_t, burst, singlePulse, ax, canvas):
     """
@@ -66,130 +783,376 @@ def loadProfile(signal_type, spike_amplitude, ref_amplitude, spike_time, ref_tim
     then updates the embedded plot with the loaded pulse.
     
     Parameters:
-      signal_type (str): The type of signal ("Square", "Triangle", "Model").
+      signal_type (str): The type of signal ("Square" or one of pulseFamilies).
       spike_amplitude (float): Amplitude in Volts.
       ref_amplitude (float): Reference amplitude in Volts.
       spike_time (float): Peaktime in milliseconds.
       ref_time (float): Reference time in milliseconds.
       delta_t (float): Delta time in milliseconds.
       burst (bool): Whether burst mode is enabled.
-      pulseWidth (float): Pulse width in milliseconds.
+      singlePulse (bool): If True, the returning (shifted) pulse is not subtracted.
       ax (matplotlib.axes.Axes): The axes to update.
       canvas (FigureCanvasTkAgg): The canvas to redraw.
     """
-    pulseWidth = spike_time + ref_time
-    frequency = (1 / (float(spike_time + ref_time) + delta_t)) * 10**3
-    amplitdueVpp = 1
-    offset = 0
-    pulse = None
-
-    if signal_type == "Square":
-        # Generate the square pulse using the provided parameters.
-        pulse = mf.generateSQUSQU(float(spike_amplitude), float(ref_amplitude), spike_time, ref_time, float(pulseWidth), numberScaleFactor)
-
-        # Check if the user want a difference-pulse or a single pulse
-        if singlePulse:
-            pulseDiff = pulse
-            frequency = (1 / (float(spike_time + ref_time))) * 10**3
-        else: pulseDiff = mf.getPulseDifference(pulse, int(delta_t)*numberScaleFactor)
-        datastring, amplitdueVpp, offset = mf.createArbString(pulseDiff, 0)
-
-        # Send the pulse to the device and wait for it to load.
-        sendAndSaveCustom("0," + datastring) # The 0, is important to tell the device to start with 0V. This is the idle DC value in burst mode. The device will always return to this value after the pulse.
-        time.sleep(loadTimeSeconds)
-
-        # Update the embedded plot with the normalized pulse.
-        updatePlot(ax, canvas, pulseDiff, float(pulseWidth), "SQU")
-    
-    else:
-        print("Unknown type!")
+    profile = buildProfile(signal_type, spike_amplitude, ref_amplitude, spike_time, ref_time, delta_t, singlePulse)
+    if profile is None:
         return
+    applyProfile(profile, burst)
 
-    # If burst mode is enabled, prepare the trigger. Important: Without burst mode the trigger won't work and the profiles may not be applied correctly.
-    if burst:
-        print("Preparing the trigger mode")
-        prepareTrigger(frequency, amplitude=amplitdueVpp/2, offset=offset/2)
-        time.sleep(3)
-        global triggerActive
-        triggerActive = True
-        
-    print("Profile has been loaded.")
-
-def turnOnOutput():
-    """Turns on the output of the generator without changing any settings."""
-    smu = rm.open_resource(pyvisaAdress)
-    smu.write("OUTP ON")
-
-def turnOffOutput():
-    """Turns off the output of the generator without changing any settings."""
-    smu = rm.open_resource(pyvisaAdress)
-    smu.write("OUTP OFF")
-
-def sendAndSaveCustom(customDatastring):
-    """Sends and applies a custome signal string - also stores the pulsform. Does not apply the profile directly."""
-    smu = rm.open_resource(pyvisaAdress)
-    smu.write(f"DATA VOLATILE, {customDatastring}") # Write arbitary waveform in volatile memory of the device
-    smu.write(f"DATA:COPY {defaultProfile}, VOLATILE")  # Copy the waveform into a profile (here ARB3)
-    smu.write(f"FUNC:USER {defaultProfile}")  # Activate the profile for the User Mode
-    smu.close()
-
-def prepareTrigger(frequency, amplitude, offset=0, cycle_count=1, start_phase=0):
-    """Applies the default settings for the Burst-Mode and applies the mode."""
-    smu = rm.open_resource(pyvisaAdress)
-    smu.write(f"FREQ {frequency}")      # Set the frequency
-    smu.write(f"VOLT {amplitude}")      # Set the amplitude
-    smu.write(f"VOLT:UNIT VPP")      # Set the amplitude unit
-    smu.write(f"VOLT:OFFS {offset}")    # Set the DC offset
-    smu.write(f"FUNC:USER {defaultProfile}")  # Select the USER waveform profile
-    smu.write(f"BURS:NCYC {cycle_count}") # Set the number of cycles
-    smu.write(f"BURS:PHAS {start_phase}") # Set the start phase
-    smu.write("BURS:MODE TRIG") # Set the burst mode to trigger
-    smu.write("TRIG:SOUR BUS") # Set the source of the trigger (basically tell the device how we send the trigger)
-    smu.write("BURS:STAT ON") # Turn on the burst mode
-    smu.close()
-
-def sendTrigger():
-    """Sends a single external trigger. Only works in Burst-Mode"""
-    print("Sending trigger:")
-    smu = rm.open_resource(pyvisaAdress)
-    smu.write("*TRG")
-    smu.close()
-    time.sleep(0.1)
+    # Update the embedded plot with the loaded pulse.
+    updatePlot(ax, canvas, profile["pulse"], profile["duration"], profile["plotType"])
+
+@traced("wait")
+def waitForCompletion(timeoutSeconds=completionTimeoutSeconds, instrument=None):
+    """
+    Blocks until the device has finished all pending commands, but at most timeoutSeconds.
+    Uses *OPC?, which the device only answers after every previous command is complete,
+    so the wait takes exactly as long as the device needs (reading again while the adapter
+    gives up earlier, see InstrumentSession._pollAnswer). If nothing was sent since the
+    last completed wait, the device is not asked at all.
+
+    Raises:
+      TimeoutError: If the device did not finish within timeoutSeconds.
+    """
+    with instrument or session as smu:
+        if not smu.pendingWrites:
+            return True
+        try:
+            answer = smu.query("*OPC?", timeoutMs=int(timeoutSeconds * 1000))
+        except pyvisa.errors.VisaIOError as e:
+            if isTimeout(e):
+                raise TimeoutError(f"Device did not finish within {timeoutSeconds} s.") from e
+            raise
+        smu.pendingWrites = False
+        return answer.strip() == "1"
+
+def turnOnOutput(instrument=None):
+    """Turns on the output of the generator without changing any settings. Returns once the device has confirmed it."""
+    with instrument or session as smu, smu.batch():
+        smu.write("OUTP ON")
+
+def turnOffOutput(instrument=None):
+    """Turns off the output of the generator without changing any settings. Returns once the device has confirmed it."""
+    with instrument or session as smu, smu.batch():
+        smu.write("OUTP OFF")
+
+def verifyArb(name, expected, instrument=None):
+    """
+    Compares the attributes the device reports for an arb with the expected ones (see mf.getArbAttributes).
+    All attributes and the error queue are read in one round trip, the waveform itself is not read back.
+
+    Parameters:
+      name (str): Name of the arb on the device, e.g. VOLATILE.
+      expected (dict): The result of mf.getArbAttributes for the data that was sent.
+
+    Returns:
+      list: Descriptions of the differences. Empty if the arb matches.
+
+    Raises:
+      InstrumentError: If the device reports an error (e.g. a broken upload or an unknown arb).
+    """
+    with instrument or session as smu:
+        answer = smu.query(f"DATA:ATTR:POIN? {name};:DATA:ATTR:AVER? {name};:DATA:ATTR:PTP? {name};:SYST:ERR?",
+                           int(loadTimeSeconds * 1000))
+        fields = [field.strip() for field in answer.split(";", 3)]
+        smu._raiseErrors(fields[-1])
+        if len(fields) < 4: # A failed attribute query has no answer
+            return [f"no attributes for {name}"]
+        points, average, peakToPeak, _ = fields
+        problems = []
+        tolerance = 1.5 / mf.DAC_MAX # The device reports the attributes rounded to its 14-bit values
+        if int(float(points)) != expected["points"]:
+            problems.append(f"{int(float(points))} instead of {expected['points']} points")
+        if abs(float(average) - expected["average"]) > tolerance:
+            problems.append(f"average {float(average):.5f} instead of {expected['average']:.5f}")
+        if abs(float(peakToPeak) - expected["peakToPeak"]) > tolerance:
+            problems.append(f"peak to peak {float(peakToPeak):.5f} instead of {expected['peakToPeak']:.5f}")
+        return problems
+
+def uploadVerified(send, name, expected, instrument=None):
+    """
+    Calls send() to write a waveform into the arb name and checks it with verifyArb. A failed upload
+    (wrong attributes or a device error) is sent again up to uploadRetries times.
+
+    Raises:
+      UploadVerificationError: If the attributes of the last attempt did not match.
+      InstrumentError: If the device reported an error for the last attempt.
+    """
+    with instrument or session as smu:
+        for attempt in range(uploadRetries + 1):
+            try:
+                send()
+                problems = verifyArb(name, expected, instrument=smu) if verifyUploads else []
+                if not problems:
+                    return
+                failure = UploadVerificationError(problems)
+            except InstrumentError as e: # Errors of the upload itself
+                failure = e
+            print(f"Upload {attempt + 1} of {uploadRetries + 1} failed: {failure}")
+        raise failure
+
+def sendAndSaveCustom(customDatastring, instrument=None, expected=None):
+    """Sends and applies a custome signal string - also stores the pulsform. Does not apply the profile directly.
+    The upload is checked with verifyArb; expected are its attributes (mf.getArbAttributes), computed from the string if not given."""
+    if expected is None and verifyUploads:
+        expected = mf.getArbAttributes(np.rint(np.array(customDatastring.split(","), dtype=float) * mf.DAC_MAX))
+    with instrument or session as smu, smu.batch(loadTimeSeconds): # One message, checked for errors
+        uploadVerified(lambda: smu.write(f"DATA VOLATILE, {customDatastring}"), "VOLATILE", expected, instrument=smu) # Write arbitary waveform in volatile memory of the device
+        smu.write(f"DATA:COPY {defaultProfile}, VOLATILE")  # Copy the waveform into a profile (here ARB3)
+        smu.write(f"FUNC:USER {defaultProfile}")  # Activate the profile for the User Mode
+        smu.activeProfile = smu.shadowSettings["FUNC:USER"] = defaultProfile
+
+def prologixEscape(data: bytes):
+    """Escapes CR, LF, ESC and '+' in binary data, so the Prologix adapter passes them on instead of interpreting them."""
+    for special in (b"\x1b", b"\r", b"\n", b"+"): # ESC has to be escaped first
+        data = data.replace(special, b"\x1b" + special)
+    return data
+
+def createDacUpload(dacCodes, bigEndian=None):
+    """Returns the complete DATA:DAC message (escaped for the Prologix adapter) that writes the DAC codes into volatile memory.
+    bigEndian defaults to bigEndianTransfer."""
+    block = mf.createDacBlock(dacCodes, bigEndian=bigEndianTransfer if bigEndian is None else bigEndian)
+    return b"DATA:DAC VOLATILE, " + prologixEscape(block) + b"\n"
+
+def sendAndSaveCustomDac(dacCodes, profileName=defaultProfile, instrument=None, upload=None):
+    """Sends and applies a custom signal as binary 14-bit DAC codes - also stores the pulsform. Does not apply the profile directly.
+    Transfers 2 bytes per point instead of ~10 for the ASCII string of sendAndSaveCustom.
+    upload is the message of createDacUpload(dacCodes) if it was created before (it must use bigEndianTransfer).
+    The upload is checked with verifyArb before it is copied; only the block is sent again if it fails."""
+    upload = upload or createDacUpload(dacCodes)
+    expected = mf.getArbAttributes(dacCodes) if verifyUploads else None
+    with instrument or session as smu, smu.batch(loadTimeSeconds): # The commands after the block are sent as one message
+        smu.applySettings({"FORM:BORD": "NORM" if bigEndianTransfer else "SWAP"}) # Byte order of the binary block (only sent once)
+        smu.flush() # Errors of the commands before the block are not upload failures (write_raw flushes anyway)
+        uploadVerified(lambda: smu.write_raw(upload), "VOLATILE", expected, instrument=smu) # Write arbitary waveform in volatile memory of the device
+        if profileName != "VOLATILE":
+            smu.write(f"DATA:COPY {profileName}, VOLATILE")  # Copy the waveform into a profile
+        smu.write(f"FUNC:USER {profileName}")  # Activate the profile for the User Mode (also if it was selected before, its data changed)
+        smu.activeProfile = smu.shadowSettings["FUNC:USER"] = profileName
+
+def loadCachedDac(dacCodes, instrument=None, upload=None):
+    """Selects the given DAC codes as the active arb. The waveform is only uploaded if it is not
+    stored in one of the arb slots already (see ArbSlotCache). Returns True if it was uploaded.
+    If no slot can be freed, the waveform is only written to volatile memory and selected from there.
+    upload is the precomputed message of createDacUpload(dacCodes), if there is one."""
+    with instrument or session as smu:
+        name = smu.arbCache.nameFor(dacCodes)
+        if smu.arbCache.lookup(smu, name):
+            with smu.batch():
+                smu.applySettings({"FUNC:USER": name}) # Not sent if the arb is selected already
+            smu.activeProfile = name
+            return False
+        try:
+            with smu.batch(loadTimeSeconds): # Deleting old arbs is sent together with the upload
+                if not smu.arbCache.reserve(smu, name):
+                    if "VOLATILE" in smu.arbCache.pinned:
+                        raise RuntimeError("All arb slots are in use. Delete user arbs on the device to make room.")
+                    name = "VOLATILE"
+                sendAndSaveCustomDac(dacCodes, name, instrument=smu, upload=upload)
+        except Exception:
+            smu.arbCache.invalidate() # The slot state of the device is unknown now
+            smu.forgetSettings("FUNC:USER")
+            raise
+        return True
+
+def prepareTrigger(frequency, amplitude, offset=0, cycle_count=1, start_phase=0, instrument=None):
+    """Applies the default settings for the Burst-Mode and applies the mode.
+    Only the settings that differ from the last values sent are written (see InstrumentSession.applySettings),
+    all in one message."""
+    with instrument or session as smu, smu.batch():
+        smu.applySettings({
+            "FREQ": frequency,          # Set the frequency
+            "VOLT": amplitude,          # Set the amplitude
+            "VOLT:UNIT": "VPP",         # Set the amplitude unit
+            "VOLT:OFFS": offset,        # Set the DC offset
+            "FUNC:USER": smu.activeProfile, # Select the USER waveform profile
+            "BURS:NCYC": cycle_count,   # Set the number of cycles
+            "BURS:PHAS": start_phase,   # Set the start phase
+            "BURS:MODE": "TRIG",        # Set the burst mode to trigger
+            "TRIG:SOUR": "BUS",         # Set the source of the trigger (basically tell the device how we send the trigger)
+            "BURS:STAT": "ON",          # Turn on the burst mode
+        })
+        smu.burstDurationSeconds = cycle_count / float(frequency)
+
+def sendTrigger(wait=True, log=True, instrument=None):
+    """Sends a single external trigger. Only works in Burst-Mode.
+    If wait is True, returns only after the device has processed the trigger and raises InstrumentError
+    if the device ignored it (e.g. because the burst mode is off)."""
+    if log:
+        print("Sending trigger:")
+    with instrument or session as smu:
+        finishReset(instrument=smu)
+        if wait:
+            with smu.batch(triggerTimeSeconds): # The error check also confirms that the trigger was processed
+                smu.write("*TRG")
+        else:
+            smu.write("*TRG")
+
+def waitUntil(deadline):
+    """Waits until time.perf_counter() reaches deadline. Sleeps most of the time and busy-waits the last triggerSpinSeconds."""
+    remaining = deadline - time.perf_counter()
+    if remaining > triggerSpinSeconds:
+        time.sleep(remaining - triggerSpinSeconds)
+    while time.perf_counter() < deadline:
+        pass
+
+def getTriggerStatistics(timestamps, intervalSeconds):
+    """
+    Compares the actual send times of a trigger train with its schedule.
+
+    Parameters:
+      timestamps (array-like): Send times in seconds (monotonic clock).
+      intervalSeconds (float): The programmed interval between two triggers.
+
+    Returns:
+      dict: Statistics in seconds:
+        - "count": Number of triggers.
+        - "meanInterval": Mean time between two triggers.
+        - "jitter": Standard deviation of the time between two triggers.
+        - "maxDeviation": Largest deviation of a trigger from its scheduled time.
+        - "drift": Deviation of the last trigger from its scheduled time.
+    """
+    timestamps = np.asarray(timestamps, dtype=float)
+    deviations = timestamps - (timestamps[0] + intervalSeconds * np.arange(len(timestamps)))
+    intervals = np.diff(timestamps)
+    return {
+        "count": len(timestamps),
+        "meanInterval": float(intervals.mean()) if len(intervals) else 0.0,
+        "jitter": float(intervals.std()) if len(intervals) else 0.0,
+        "maxDeviation": float(np.abs(deviations).max()),
+        "drift": float(deviations[-1]),
+    }
+
+def sendTriggerTrain(count, intervalSeconds, progress=None, instrument=None):
+    """
+    Sends a train of triggers at a fixed interval. Only works in Burst-Mode (see prepareTrigger).
+
+    The triggers are scheduled on a monotonic clock relative to the first one, so delays of single
+    triggers do not add up. The session stays locked (and connected) for the whole train.
+
+    Parameters:
+      count (int): Number of triggers.
+      intervalSeconds (float): Time between two triggers. Must not be shorter than one burst.
+      progress (callable, optional): Called with a status message after each trigger.
+      instrument (InstrumentSession, optional): The device to use. Defaults to the global session.
+
+    Returns:
+      dict: The actual send times ("timestamps") and the statistics of getTriggerStatistics.
+    """
+    count = int(count)
+    if count < 1:
+        raise ValueError("The trigger count must be at least 1.")
+    instrument = instrument or session
+    finishReset(instrument=instrument)
+    if count > 1 and intervalSeconds < instrument.burstDurationSeconds: # The interval does not matter for a single trigger
+        raise ValueError(f"The interval must not be shorter than one burst ({instrument.burstDurationSeconds * 1000:.3f} ms).")
+
+    timestamps = []
+    with instrument:
+        start = time.perf_counter()
+        for i in range(count):
+            waitUntil(start + i * intervalSeconds)
+            timestamps.append(time.perf_counter())
+            sendTrigger(wait=False, log=False, instrument=instrument)
+            if progress is not None:
+                progress(f"Trigger {i + 1}/{count}")
+        instrument.checkErrors() # Once after the train, so the intervals stay exact
+
+    result = getTriggerStatistics(timestamps, intervalSeconds)
+    result["timestamps"] = timestamps
+    print(f"Sent {count} triggers: mean interval {result['meanInterval'] * 1000:.3f} ms, jitter {result['jitter'] * 1000:.3f} ms, drift {result['drift'] * 1000:.3f} ms")
+    return result
 
 # This function is not really used, because it won't work with impulses as it tries to apply it immediately. However, in trigger mode it is not possible. Might be useful for other applications.
-def sendCustom(signal_str:str, frequency, amplitude, offset=0):
+def sendCustom(signal_str:str, frequency, amplitude, offset=0, instrument=None):
     """Sends and applies a custome signal string - also stores the pulsform."""
-    smu = rm.open_resource(pyvisaAdress)
-    smu.write(f"DATA VOLATILE, {signal_str}") # Write arbitary waveform in volatile memory of the device
-    smu.write(f"DATA:COPY {defaultProfile}, VOLATILE")  # Copy the waveform into a profile (here ARB3)
-    smu.write(f"FUNC:USER {defaultProfile}")  # Activate the profile for the User Mode
-    smu.write(f"APPL:USER {frequency}, {amplitude}, {offset}") # Apply the profile with the given parameters -> would change the output immediately
-    smu.close()
-
-### NOTE: The save wasn't working properly if I remember correctly. Be careful if you are using it.
-def sendReset(durationSeconds: int, amplitude: float):
-    """Temporarily sets the generator to DC voltage for the specified time and amplitude,
-    then restores the previous waveform without overwriting any user-defined profiles."""
-    
-    smu = rm.open_resource(pyvisaAdress)
-    
-    try:
-        # Speichere den aktuellen Zustand
-        previous_function = smu.query("FUNC?").strip()  # Aktuelle Wellenform
-        previous_amplitude = smu.query("VOLT?").strip()  # Aktuelle Amplitude
-        previous_offset = smu.query("VOLT:OFFS?").strip()  # Aktueller Offset
-        
-        # Setze DC-Spannung mit gewünschter Amplitude
-        smu.write("FUNC DC")  # Setzt DC-Modus
-        smu.write(f"VOLT:OFFS {float(amplitude)/2}")  # Setzt den Offset auf die gewünschte DC-Spannung
-        
-        time.sleep(durationSeconds)  # Wartezeit für die DC-Phase
-        
-        # Kehre zum vorherigen Zustand zurück
-        smu.write(f"FUNC {previous_function}")  # Setzt die vorherige Wellenform
-        smu.write(f"VOLT {previous_amplitude}")  # Stellt die vorherige Amplitude wieder her
-        smu.write(f"VOLT:OFFS {previous_offset}")  # Stellt den vorherigen Offset wieder her
-        smu.write("BURS:STAT ON")
+    with instrument or session as smu, smu.batch(loadTimeSeconds):
+        smu.write(f"DATA VOLATILE, {signal_str}") # Write arbitary waveform in volatile memory of the device
+        smu.write(f"DATA:COPY {defaultProfile}, VOLATILE")  # Copy the waveform into a profile (here ARB3)
+        smu.write(f"FUNC:USER {defaultProfile}")  # Activate the profile for the User Mode
+        smu.write(f"APPL:USER {frequency}, {amplitude}, {offset}") # Apply the profile with the given parameters -> would change the output immediately
+        smu.activeProfile = smu.shadowSettings["FUNC:USER"] = defaultProfile
+        smu.forgetSettings("FREQ", "VOLT", "VOLT:OFFS", "BURS:STAT") # APPL also turns off the burst mode
 
-    finally:
-        smu.close()
+def buildResetProfile(durationSeconds, amplitude):
+    """
+    Computes the reset pulse: a single burst that holds the given level for exactly durationSeconds.
+    The arb has resetPoints points, the first one is the 0 V idle value and all others the level,
+    so the period is stretched by one point to keep the level for durationSeconds.
+    The DAC codes only depend on the sign of the amplitude, so the arb stays in its slot (see ArbSlotCache).
+
+    Returns:
+      dict: "dacCodes", "upload", "frequency", "amplitude" and "offset" like buildProfile.
+    """
+    durationSeconds = float(durationSeconds)
+    amplitude = float(amplitude)
+    if durationSeconds <= 0:
+        raise ValueError("The reset duration must be positive.")
+    if amplitude == 0:
+        raise ValueError("The reset amplitude must not be 0.")
+    voltages = np.full(resetPoints, amplitude)
+    voltages[0] = 0.0
+    dacCodes, amplitudeVpp, offset = mf.createArbDac(voltages, inPlace=True)
+    return {
+        "dacCodes": dacCodes,
+        "upload": createDacUpload(dacCodes),
+        "frequency": (resetPoints - 1) / (resetPoints * durationSeconds),
+        "amplitude": amplitudeVpp,
+        "offset": offset,
+    }
+
+def sendReset(durationSeconds: int, amplitude: float, instrument=None):
+    """
+    Sends a reset pulse of the given duration and amplitude, timed by the generator.
+
+    The reset arb is selected with burst settings for one period of durationSeconds and a single
+    trigger starts it, so the host is free right away and the duration is exact. The pulse profile
+    stays in its slot; its settings are selected again by finishReset before the next trigger or load
+    (one message, after the reset burst is over).
+    """
+    with instrument or session as smu:
+        if smu.pendingRestore is not None:
+            waitUntil(smu.resetDeadline) # A running reset has to end first. The pulse profile is restored after this one.
+            previous, previousBurst = smu.pendingRestore
+        else:
+            previous = {}
+            for header in ("FREQ", "VOLT", "VOLT:OFFS", "FUNC:USER"): # The settings of the pulse profile
+                previous[header] = smu.shadowSettings.get(header) or smu.query(f"{header}?").strip().strip('"')
+            previousBurst = smu.burstDurationSeconds
+
+        reset = buildResetProfile(durationSeconds, amplitude)
+        smu.arbCache.pinned = {previous["FUNC:USER"]} # The reset arb must not take the slot of the pulse profile
+        try:
+            loadCachedDac(reset["dacCodes"], instrument=smu, upload=reset["upload"])
+            with smu.batch(): # Burst settings and trigger in one message
+                prepareTrigger(reset["frequency"], amplitude=reset["amplitude"]/2, offset=reset["offset"]/2, instrument=smu)
+                smu.write("*TRG")
+        except Exception:
+            if smu.pendingRestore is None:
+                smu.arbCache.pinned.clear()
+            raise
+        smu.resetDeadline = time.perf_counter() + 1 / reset["frequency"]
+        smu.pendingRestore = (previous, previousBurst)
+
+def finishReset(instrument=None):
+    """
+    Waits until a reset burst started by sendReset is over and selects the pulse profile again.
+    Does nothing if there is no reset to finish. Returns True if the profile was restored.
+    The restore is only tried once: if it fails, the error is raised and the next profile load starts from scratch.
+    """
+    with instrument or session as smu:
+        if smu.pendingRestore is None:
+            return False
+        settings, burstDurationSeconds = smu.pendingRestore
+        waitUntil(smu.resetDeadline)
+        smu.pendingRestore = None
+        smu.arbCache.pinned.clear()
+        try:
+            with smu.batch():
+                smu.applySettings(settings)
+        except Exception:
+            smu.arbCache.invalidate() # The pulse profile may not be in its slot anymore
+            raise
+        smu.activeProfile = settings["FUNC:USER"]
+        smu.burstDurationSeconds = burstDurationSeconds
+        return True